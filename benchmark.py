@@ -0,0 +1,467 @@
+"""Замеры производительности этапов обработки пакетов `homework.py`.
+
+Каждый этап выполняется на синтетическом наборе пакетов со смесью
+RUN/WLK/SWM: сначала замеряется время, затем отдельным прогоном —
+пиковая память через `tracemalloc`. Набор генерируется и замеряется
+частями по `--chunk-size` пакетов, поэтому память ограничена размером
+части, а не набора.
+
+Запуск:
+    python benchmark.py --sizes 1000,10000 --save baseline.json
+    python benchmark.py --sizes 1000,10000 --compare baseline.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from functools import partial
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import homework
+
+MIX = (('RUN', 0.5), ('WLK', 0.3), ('SWM', 0.2))
+DEFAULT_SIZES = '1000,10000,100000'
+DEFAULT_THRESHOLD = 0.1
+DEFAULT_REPEAT = 3
+DEFAULT_CHUNK_SIZE = 100000
+CONNECTIONS = 16
+THREADS = (1, 2, 4, 8, 16, 32)
+WRITE_EVERY = 10
+
+Package = Tuple[str, list]
+Stage = Tuple[str, int, Callable[[], object]]
+
+
+def make_package(rng: random.Random, workout_type: str) -> Package:
+    """Сгенерировать правдоподобный пакет заданного вида."""
+    duration = rng.uniform(0.25, 3)
+    weight = rng.uniform(40, 120)
+    if workout_type == 'RUN':
+        return workout_type, [rng.randint(1000, 30000), duration, weight]
+    if workout_type == 'WLK':
+        return workout_type, [
+            rng.randint(1000, 30000), duration, weight, rng.uniform(140, 210)
+        ]
+    return workout_type, [
+        rng.randint(200, 3000), duration, weight,
+        rng.choice((25, 50)), rng.randint(10, 80)
+    ]
+
+
+def make_chunk(count: int, seed: int, number: int) -> List[Package]:
+    """Сгенерировать часть `number` набора: `count` пакетов смеси `MIX`.
+
+    У каждой части свой генератор, поэтому часть не зависит от
+    предыдущих, а меньший набор совпадает с началом большего.
+    """
+    rng = random.Random(f'{seed}-{number}')
+    codes = [code for code, _ in MIX]
+    weights = [weight for _, weight in MIX]
+    return [
+        make_package(rng, workout_type)
+        for workout_type in rng.choices(codes, weights, k=count)
+    ]
+
+
+def iter_chunks(count: int, seed: int = 0,
+                chunk_size: int = DEFAULT_CHUNK_SIZE
+                ) -> Iterator[List[Package]]:
+    """Отдать набор из `count` пакетов частями по `chunk_size`."""
+    for number, start in enumerate(range(0, count, chunk_size)):
+        yield make_chunk(min(chunk_size, count - start), seed, number)
+
+
+def make_packages(count: int, seed: int = 0,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[Package]:
+    """Сгенерировать `count` пакетов со смесью видов тренировок `MIX`."""
+    return [
+        package
+        for chunk in iter_chunks(count, seed, chunk_size)
+        for package in chunk
+    ]
+
+
+def _stage(name: str, inputs: list,
+           func: Callable[[list], object]) -> Stage:
+    """Собрать этап, входные данные которого хранит только замер.
+
+    Когда `run` отпускает функцию этапа, данные освобождаются, и
+    наборы разных этапов не лежат в памяти одновременно.
+    """
+    return name, len(inputs), partial(func, inputs)
+
+
+def pipeline_stages(packages: List[Package]) -> Iterator[Stage]:
+    """Этапы конвейера: проверка, создание объектов, расчёт и вывод.
+
+    `read_package` включает проверку пакета и создание объекта, поэтому
+    стоимость самой проверки — разница между ним и `construct`.
+    """
+    read_package = homework.read_package
+    yield 'read_package', len(packages), lambda: [
+        read_package(workout_type, data) for workout_type, data in packages
+    ]
+    yield _stage('construct', [
+        (homework.TRAINING_TYPES[workout_type], data)
+        for workout_type, data in packages
+    ], lambda constructors: [
+        class_(*data) for class_, data in constructors
+    ])
+    for code, _ in MIX:
+        yield _stage(f'calories_{code}', [
+            read_package(workout_type, data)
+            for workout_type, data in packages if workout_type == code
+        ], lambda selected: [
+            training.get_spent_calories() for training in selected
+        ])
+    yield _stage('get_message', [
+        read_package(*package).show_training_info() for package in packages
+    ], lambda messages: [message.get_message() for message in messages])
+
+
+async def _send(port: int, payload: bytes) -> int:
+    """Отправить пакеты по одному соединению и дождаться ответов."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(payload)
+    writer.write_eof()
+    responses = await reader.read()
+    writer.close()
+    return responses.count(b'\n')
+
+
+async def _exchange(payloads: List[bytes]) -> int:
+    """Прогнать пакеты через сервис по нескольким соединениям сразу."""
+    server = await homework.serve(port=0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        counts = await asyncio.gather(
+            *(_send(port, payload) for payload in payloads)
+        )
+    return sum(counts)
+
+
+def service_stages(packages: List[Package]) -> Iterator[Stage]:
+    """Обработка пакетов сервисом по `CONNECTIONS` соединениям."""
+    lines = [
+        json.dumps({'workout_type': workout_type, 'data': data}) + '\n'
+        for workout_type, data in packages
+    ]
+    payloads = [
+        ''.join(lines[shift::CONNECTIONS]).encode()
+        for shift in range(CONNECTIONS)
+    ]
+    yield 'service', len(lines), lambda: asyncio.run(_exchange(payloads))
+
+
+def _run_threads(store: homework.ResultStore, messages: list,
+                 threads: int) -> None:
+    """Читать и писать хранилище из `threads` потоков одновременно.
+
+    Каждая `WRITE_EVERY`-я операция — запись, остальные — чтение.
+    """
+    def work(shift: int) -> None:
+        for number in range(shift, len(messages), threads):
+            if number % WRITE_EVERY == 0:
+                store.put(number, messages[number])
+            else:
+                store.get(number - number % WRITE_EVERY)
+
+    workers = [
+        threading.Thread(target=work, args=(shift,))
+        for shift in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def contention_stages(packages: List[Package]) -> Iterator[Stage]:
+    """Конкурентные чтение и запись `ResultStore` из 1–32 потоков."""
+    messages = [
+        homework.read_package(*package).show_training_info()
+        for package in packages
+    ]
+    for threads in THREADS:
+        yield f'threads_{threads}', len(messages), lambda threads=threads: (
+            _run_threads(homework.ResultStore(), messages, threads)
+        )
+
+
+def naive_info(training: homework.Training) -> homework.InfoMessage:
+    """Собрать сообщение тремя независимыми вызовами публичных методов.
+
+    Так `show_training_info` работала до однопроходного расчёта.
+    """
+    return homework.InfoMessage(
+        type(training).__name__,
+        training.duration,
+        training.get_distance(),
+        training.get_mean_speed(),
+        training.get_spent_calories()
+    )
+
+
+def count_calls(func: Callable[[], object]) -> int:
+    """Посчитать вызовы Python-функций из `homework.py`.
+
+    Методы, созданные `dataclass`, в подсчёт не входят.
+    """
+    calls = 0
+
+    def profile(frame, event, arg):
+        nonlocal calls
+        if event == 'call' and frame.f_code.co_filename == homework.__file__:
+            calls += 1
+
+    sys.setprofile(profile)
+    try:
+        func()
+    finally:
+        sys.setprofile(None)
+    return calls
+
+
+def calls_stages(packages: List[Package]) -> Iterator[Stage]:
+    """Сообщения о тренировках тремя способами.
+
+    Независимые вызовы методов, один проход `show_training_info`
+    и ленивое сообщение, у которого читаются только калории. Перед
+    замерами печатает число вызовов методов на одну тренировку.
+    """
+    for code, _ in MIX:
+        selected = [
+            homework.read_package(workout_type, data)
+            for workout_type, data in packages if workout_type == code
+        ]
+        if not selected:
+            continue
+        print('{code}: вызовов методов на тренировку {naive} -> {single}'
+              .format(code=code,
+                      naive=count_calls(lambda: naive_info(selected[0])),
+                      single=count_calls(selected[0].show_training_info) - 1))
+        yield f'naive_{code}', len(selected), lambda selected=selected: [
+            naive_info(training) for training in selected
+        ]
+        yield f'single_{code}', len(selected), lambda selected=selected: [
+            training.show_training_info() for training in selected
+        ]
+        yield f'lazy_{code}', len(selected), lambda selected=selected: [
+            training.show_lazy_training_info().calories
+            for training in selected
+        ]
+
+
+def _print_lines(path: str, messages: list, buffering: int = -1) -> None:
+    """Вывести сообщения построчно через `print`, как `main`.
+
+    `buffering=1` — построчная буферизация, как у stdout в терминале.
+    """
+    with open(path, 'w', buffering=buffering, encoding='utf-8') as file:
+        for message in messages:
+            print(message.get_message(), file=file)
+
+
+def _fill_sink(sink_class: type, path: str, messages: list) -> None:
+    """Записать сообщения в новый приёмник `sink_class`."""
+    if os.path.exists(path):
+        os.remove(path)
+    with sink_class(path) as sink:
+        sink.write_many(messages)
+
+
+def sink_stages(packages: List[Package]) -> Iterator[Stage]:
+    """Построчный `print` в файл против приёмников с записью пачками."""
+    messages = [
+        homework.read_package(*package).show_training_info()
+        for package in packages
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'results')
+        yield 'print', len(messages), lambda: _print_lines(path, messages)
+        yield 'print_line', len(messages), lambda: (
+            _print_lines(path, messages, buffering=1)
+        )
+        for stage, sink_class in (('file', homework.FileSink),
+                                  ('rotating', homework.RotatingFileSink),
+                                  ('sqlite', homework.SQLiteSink)):
+            yield stage, len(messages), lambda sink_class=sink_class: (
+                _fill_sink(sink_class, path, messages)
+            )
+    yield 'memory', len(messages), lambda: (
+        homework.MemorySink().write_many(messages)
+    )
+
+
+def precision_stages(packages: List[Package]) -> Iterator[Stage]:
+    """Пакетный расчёт `compute_batch` в каждом режиме точности.
+
+    Перед замерами печатает наибольшую погрешность режима
+    относительно `double` или сообщение о превышении допуска.
+    """
+    for code, _ in MIX:
+        rows = [
+            data for workout_type, data in packages if workout_type == code
+        ]
+        if not rows:
+            continue
+        for precision in homework.PRECISIONS:
+            trainings = homework.TrainingColumns(code, precision)
+            trainings.extend(rows)
+            try:
+                error = '{:.2e}'.format(homework.check_precision(
+                    code, trainings.columns, precision
+                ))
+            except ValueError as message:
+                error = str(message)
+            print(f'{code} {precision}: погрешность {error}')
+            yield f'{precision}_{code}', len(rows), partial(
+                homework.compute_batch, code, trainings.columns, precision
+            )
+
+
+SUITES = {
+    'calls': calls_stages,
+    'contention': contention_stages,
+    'pipeline': pipeline_stages,
+    'precision': precision_stages,
+    'service': service_stages,
+    'sinks': sink_stages
+}
+
+
+def measure(func: Callable[[], object],
+            repeat: int = DEFAULT_REPEAT) -> Tuple[float, int]:
+    """Замерить лучшее из `repeat` время и пиковую память функции."""
+    elapsed = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = min(elapsed, time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return elapsed, peak
+
+
+def measure_chunks(suite: str, size: int, seed: int,
+                   repeat: int = DEFAULT_REPEAT,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE
+                   ) -> Dict[str, List]:
+    """Замерить этапы набора по частям и сложить время частей.
+
+    Возвращает для каждого этапа число пакетов, суммарное время и
+    наибольшую пиковую память одной части. Пояснения этапов
+    печатаются только для первой части.
+    """
+    totals: Dict[str, List] = {}
+    for number, chunk in enumerate(iter_chunks(size, seed, chunk_size)):
+        with redirect_stdout(sys.stdout if not number else io.StringIO()):
+            for stage, count, func in SUITES[suite](chunk):
+                elapsed, peak = measure(func, repeat)
+                del func
+                total = totals.setdefault(stage, [0, 0.0, 0])
+                total[0] += count
+                total[1] += elapsed
+                total[2] = max(total[2], peak)
+        del chunk
+    return totals
+
+
+def run(suite: str, sizes: List[int], seed: int,
+        repeat: int = DEFAULT_REPEAT,
+        chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[Dict]:
+    """Выполнить все этапы набора для каждого размера данных."""
+    results = []
+    for size in sizes:
+        totals = measure_chunks(suite, size, seed, repeat, chunk_size)
+        for stage, (count, elapsed, peak) in totals.items():
+            result = {
+                'suite': suite,
+                'size': size,
+                'stage': stage,
+                'count': count,
+                'seconds': elapsed,
+                'per_second': count / elapsed if elapsed else 0.0,
+                'chunk_size': chunk_size,
+                'peak_bytes': peak,
+            }
+            results.append(result)
+            print(
+                '{suite:<10} {size:>9} {stage:<16} {count:>9} '
+                '{seconds:>9.4f} s {per_second:>13,.0f}/s '
+                '{peak_bytes:>13,} B'.format(**result)
+            )
+    return results
+
+
+def compare(results: List[Dict], baseline: List[Dict],
+            threshold: float) -> int:
+    """Сравнить результаты с сохранёнными и вернуть число регрессий."""
+    previous = {
+        (item['suite'], item['size'], item['stage']): item
+        for item in baseline
+    }
+    regressions = 0
+    for item in results:
+        old = previous.get((item['suite'], item['size'], item['stage']))
+        if old is None or not old['per_second']:
+            continue
+        change = item['per_second'] / old['per_second'] - 1
+        regressed = change < -threshold
+        regressions += regressed
+        print('{suite:<10} {size:>9} {stage:<16} {change:>+8.1%}{mark}'.format(
+            change=change, mark=' РЕГРЕССИЯ' if regressed else '', **item
+        ))
+    return regressions
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    """Разобрать аргументы командной строки."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--suite', choices=sorted(SUITES),
+                        default='pipeline')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help='размеры наборов через запятую, например 1e3,1e6')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='число повторов, берётся лучшее время')
+    parser.add_argument('--chunk-size', type=float,
+                        default=DEFAULT_CHUNK_SIZE,
+                        help='пакетов в части набора, например 1e5')
+    parser.add_argument('--save', help='сохранить результаты в JSON')
+    parser.add_argument('--compare', help='сравнить с сохранённым JSON')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='допустимое замедление, доля (0.1 = 10%%)')
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> int:
+    """Главная функция."""
+    args = parse_args(argv)
+    sizes = [int(float(size)) for size in args.sizes.split(',')]
+    results = run(args.suite, sizes, args.seed, args.repeat,
+                  int(args.chunk_size))
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            return 1 if compare(results, json.load(file),
+                                args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
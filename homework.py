@@ -1,9 +1,61 @@
-from dataclasses import asdict, dataclass, fields
+import io
+import json
+import math
+import numbers
+import os
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from array import array
+from collections import Counter, OrderedDict, deque
+from dataclasses import asdict, dataclass, field, fields
+from functools import partial, wraps
+from itertools import islice
+from operator import attrgetter
+from string import Formatter
+from typing import (TYPE_CHECKING, Any, BinaryIO, Callable, Dict, Iterable,
+                    Iterator, List, Mapping, MutableSet, Optional,
+                    Sequence, Sized, TextIO, Tuple, Union)
+
+if TYPE_CHECKING:
+    import argparse
+    import asyncio
+    import mmap
+    from concurrent.futures import Executor
+    from datetime import date, datetime, timedelta
+
+
+def compile_template(template: str) -> Callable[[Any], str]:
+    """Скомпилировать шаблон с именованными полями в быстрый форматтер.
+
+    Имена полей заменяются позиционными подстановками, а значения
+    читаются одним `attrgetter`, поэтому форматирование не требует
+    построения словаря полей.
+    """
+    parts, names = [], []
+    for literal, name, spec, conversion in Formatter().parse(template):
+        parts.append(literal.replace('{', '{{').replace('}', '}}'))
+        if name is not None:
+            names.append(name)
+            parts.append(
+                '{'
+                + ('!' + conversion if conversion else '')
+                + (':' + spec if spec else '')
+                + '}'
+            )
+    render = ''.join(parts).format
+    get_values = attrgetter(*names)
+    if len(names) == 1:
+        return lambda instance: render(get_values(instance))
+    return lambda instance: render(*get_values(instance))
 
 
 @dataclass
 class InfoMessage:
     """Информационное сообщение о тренировке."""
+    __slots__ = ('training_type', 'duration', 'distance', 'speed', 'calories')
+
     training_type: str
     duration: float
     distance: float
@@ -19,8 +71,122 @@ class InfoMessage:
     )
 
     def get_message(self):
-        """Выводит на экран информацию о тренировке."""
-        return self.MESSAGE.format(**asdict(self))
+        """Выводит на экран информацию о тренировке.
+
+        Шаблон берётся из `MESSAGE` класса сообщения, так что подкласс
+        может задать свой формат.
+        """
+        template = type(self).MESSAGE
+        render = _MESSAGE_FORMATTERS.get(template)
+        if render is None:
+            render = _MESSAGE_FORMATTERS[template] = compile_template(
+                template
+            )
+        return render(self)
+
+
+class LazyInfoMessage(InfoMessage):
+    """Сообщение о тренировке с расчётом полей по требованию.
+
+    Дистанция, скорость и калории считаются при первом чтении
+    и кешируются. Сообщение равно `InfoMessage` с теми же значениями.
+    """
+    __slots__ = ('training', '_distance', '_speed', '_calories')
+
+    def __init__(self, training: Optional['Training'] = None,
+                 **values: Any) -> None:
+        """Создать сообщение по тренировке или по готовым полям.
+
+        Без `training` поля передаются по имени, как в `InfoMessage`:
+        так сообщение копирует `dataclasses.replace`.
+        """
+        self.training = training
+        self._distance = self._speed = self._calories = None
+        if training is None:
+            InfoMessage.__init__(self, **values)
+            return
+        self.training_type = type(training).__name__
+        self.duration = training.duration
+
+    @property
+    def distance(self) -> float:
+        value = self._distance
+        if value is None:
+            value = self._distance = self.training.get_distance()
+        return value
+
+    @distance.setter
+    def distance(self, value: float) -> None:
+        self._distance = value
+
+    def _get_speed(self) -> float:
+        """Рассчитать скорость по закешированной дистанции, если можно."""
+        if type(self.training).get_mean_speed is Training.get_mean_speed:
+            return self.distance / self.duration
+        return self.training.get_mean_speed()
+
+    @property
+    def speed(self) -> float:
+        value = self._speed
+        if value is None:
+            value = self._speed = self._get_speed()
+        return value
+
+    @speed.setter
+    def speed(self, value: float) -> None:
+        self._speed = value
+
+    @property
+    def calories(self) -> float:
+        value = self._calories
+        if value is None:
+            speed = self._speed
+            if speed is None:
+                speed = self._speed = self._get_speed()
+            value = self._calories = (
+                self.training._spent_calories(speed)
+                if self.training._CALORIES_BY_SPEED
+                else self.training.get_spent_calories()
+            )
+        return value
+
+    @calories.setter
+    def calories(self, value: float) -> None:
+        self._calories = value
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, InfoMessage):
+            return NotImplemented
+        return _info_values(self) == _info_values(other)
+
+
+render_message = compile_template(InfoMessage.MESSAGE)
+_render_line = compile_template(InfoMessage.MESSAGE + '\n')
+# Скомпилированные шаблоны `MESSAGE` классов сообщений.
+_MESSAGE_FORMATTERS: Dict[str, Callable[[Any], str]] = {
+    InfoMessage.MESSAGE: render_message
+}
+
+
+def render_many(messages: Iterable[InfoMessage],
+                out: Optional[TextIO] = None,
+                batch_size: int = 1024) -> int:
+    """Записать сообщения построчно в файл или буфер.
+
+    Строки склеиваются пачками по `batch_size`, поэтому на каждую
+    пачку приходится один вызов `write`. По умолчанию пишет в stdout.
+    Возвращает количество записанных сообщений.
+    """
+    out = sys.stdout if out is None else out
+    messages = iter(messages)
+    count = 0
+    while True:
+        lines = [_render_line(message)
+                 for message in islice(messages, batch_size)]
+        if not lines:
+            return count
+        out.write(''.join(lines))
+        count += len(lines)
 
 
 @dataclass
@@ -32,6 +198,7 @@ class Training:
 
     M_IN_KM = 1000  # Коэффициент для перевода метров в километры.
     LEN_STEP = 0.65  # Длина шага в метрах.
+    _CALORIES_BY_SPEED = True  # Пересчитывается в `__init_subclass__`.
 
     def get_distance(self) -> float:
         """Получить дистанцию в км."""
@@ -45,16 +212,49 @@ class Training:
         """Получить количество затраченных калорий."""
         pass
 
+    def _spent_calories(self, speed: float) -> float:
+        """Получить калории по уже рассчитанной средней скорости.
+
+        Подклассы переопределяют этот метод вместе с
+        `get_spent_calories`, чтобы `show_training_info` не
+        пересчитывала скорость и дистанцию ради калорий.
+        """
+        return self.get_spent_calories()
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        """Решить один раз для класса, можно ли считать калории
+        через `_spent_calories`.
+
+        Это так, если ближайший в MRO класс с `get_spent_calories`
+        определяет и `_spent_calories`. Иначе один из методов
+        переопределён отдельно, и `show_training_info` вызывает
+        публичный `get_spent_calories`.
+        """
+        super().__init_subclass__(**kwargs)
+        owners = [
+            next(
+                class_ for class_ in cls.__mro__ if name in vars(class_)
+            )
+            for name in ('get_spent_calories', '_spent_calories')
+        ]
+        cls._CALORIES_BY_SPEED = owners[0] is owners[1]
+
     def show_training_info(self) -> InfoMessage:
         """Вернуть информационное сообщение о выполненной тренировке."""
+        speed = self.get_mean_speed()
         return InfoMessage(
             type(self).__name__,
             self.duration,
             self.get_distance(),
-            self.get_mean_speed(),
-            self.get_spent_calories()
+            speed,
+            self._spent_calories(speed) if self._CALORIES_BY_SPEED
+            else self.get_spent_calories()
         )
 
+    def show_lazy_training_info(self) -> LazyInfoMessage:
+        """Вернуть сообщение, поля которого считаются при обращении."""
+        return LazyInfoMessage(self)
+
 
 class Running(Training):
     """Тренировка: бег."""
@@ -75,6 +275,18 @@ class Running(Training):
             * duration_minutes
         )
 
+    def _spent_calories(self, speed: float) -> float:
+        """Получить калории по средней скорости."""
+        duration_minutes = self.duration * self.HOURS_TO_MINUTES
+        return (
+            (
+                self.MULTIPLYING_MEAN_SPEED * speed
+                - self.DECREASING_MEAN_SPEED
+            )
+            * self.weight / self.M_IN_KM
+            * duration_minutes
+        )
+
 
 @dataclass
 class SportsWalking(Training):
@@ -100,6 +312,21 @@ class SportsWalking(Training):
             * duration_minutes
         )
 
+    def _spent_calories(self, speed: float) -> float:
+        """Получить калории по средней скорости."""
+        # Переводим полученные часы в минуты.
+        duration_minutes = self.duration * self.HOURS_TO_MINUTES
+        return (
+            (
+                self.MULTIPLYING_WEIGHT
+                * self.weight
+                + (speed**2 // self.height)
+                * self.MULTIPLYING_MEAN_SPEED
+                * self.weight
+            )
+            * duration_minutes
+        )
+
 
 @dataclass
 class Swimming(Training):
@@ -125,6 +352,15 @@ class Swimming(Training):
             * self.MULTIPLYING_MEAN_SPEED * self.weight
         )
 
+    def _spent_calories(self, speed: float) -> float:
+        """Получить калории по средней скорости."""
+        return (
+            (
+                speed + self.INCREASING_MEAN_SPEED
+            )
+            * self.MULTIPLYING_MEAN_SPEED * self.weight
+        )
+
 
 TRAINING_TYPES = {
     'RUN': Running,
@@ -138,35 +374,2484 @@ ERROR_CHECKING_PARAMETERS_COUNT = ('Неожиданное значение '
                                    'параметра для {workout_key}, '
                                    'количество полученных '
                                    'параметров: {count_params}')
+NO_BATCH_FUNCTION = ('Для {workout_key} (класс {name}) нет пакетного '
+                     'расчёта')
+MISSING_COLUMN = ('Для {workout_key} не передана колонка {column}')
+COLUMNS_LENGTH_MISMATCH = ('Колонки для {workout_key} имеют разную '
+                           'длину: {lengths}')
+UNEXPECTED_FORMAT = ('Неожиданный формат пакетов {package_format}')
+REJECTED_RECORD = ('Запись {number}: {error}')
+MISSING_PARAMETER = ('Для {workout_key} не передан параметр {name}')
+UNORDERED_SAMPLE = ('Отметка времени {timestamp} меньше предыдущей '
+                    '{previous}')
+EMPTY_SESSION = ('Сессия {workout_key} не содержит интервалов позже '
+                 'начала {start}')
+UNEXPECTED_METRIC = ('Неожиданный показатель {metric}')
+SKETCH_ACCURACY_MISMATCH = ('Нельзя объединить скетчи с точностью '
+                            '{accuracy} и {other}')
+UNEXPECTED_PERIOD = ('Неожиданный период {period}')
+UNEXPECTED_BYTEORDER = ('Файл истории {path} записан с порядком байт '
+                        '{byteorder}')
+TOO_MANY_TYPES = ('В истории не может быть больше {count} видов тренировок')
+UNEXPECTED_OUTPUT = ('Неожиданный формат вывода {output}')
+UNREADABLE_INPUT = ('Входной файл {path} не найден или недоступен '
+                    'для чтения')
+SUMMARY = ('Обработано пакетов: {packages}, отклонено: {rejects}, '
+           'время: {seconds:.3f} с, скорость: {rate:.0f} пакетов/с')
+SERVICE_ERROR = ('Ошибка: {error}')
+LINE_TOO_LONG = ('Строка пакета длиннее {max_line} байт')
+UNEXPECTED_CHUNK_SIZE = ('Размер части должен быть положительным, '
+                         'получено: {chunk_size}')
+UNEXPECTED_SINK_SIZE = ('Размер пачки должен быть положительным, '
+                        'получено: {max_records}')
+UNEXPECTED_TABLE = ('Неожиданное имя таблицы {table}')
+UNEXPECTED_PRECISION = ('Неожиданный режим точности {precision}')
+UNEXPECTED_SHARDS = ('Число частей должно быть положительным, '
+                     'получено: {shards}')
+PRECISION_LOSS = ('Погрешность режима {precision} в колонке {column} '
+                  '{error:.6f} больше допустимой {tolerance}')
+
+
+Validator = Callable[[Sequence[float]], None]
+
+
+@dataclass(frozen=True)
+class WorkoutSpec:
+    """Описание вида тренировки в реестре."""
+    code: str
+    constructor: Callable[..., Training]
+    field_names: Tuple[str, ...]
+    arity: int
+    validator: Optional[Validator] = None
+
+
+class WorkoutRegistry:
+    """Реестр видов тренировок, построенный заранее.
+
+    Число полей и имена колонок вычисляются один раз при регистрации,
+    поэтому `read_package` не обращается к `dataclasses.fields`.
+    Регистрация заменяет словарь описаний копией под блокировкой,
+    а чтение из любых потоков идёт без блокировок. Счётчики
+    при одновременных вызовах из нескольких потоков приблизительные.
+
+    Словарь `training_types` остаётся источником истины: регистрация
+    записывает в него класс, а изменения словаря (новый, заменённый
+    или удалённый код) подхватываются при следующем обращении.
+    """
+
+    def __init__(self,
+                 training_types: Optional[Dict[str, type]] = None) -> None:
+        self._specs: Dict[str, WorkoutSpec] = {}
+        self._lock = threading.Lock()
+        self._source = training_types
+        self.misses = 0
+        self.counts: Counter = Counter()
+        for code, training_class in list((training_types or {}).items()):
+            self.register(code, training_class)
+
+    def __contains__(self, code: str) -> bool:
+        return self.get(code) is not None
+
+    def register(self, code: str, training_class: type,
+                 validator: Optional[Validator] = None) -> WorkoutSpec:
+        """Зарегистрировать вид тренировки под кодом `code`."""
+        names = tuple(item.name for item in fields(training_class))
+        spec = WorkoutSpec(code, training_class, names, len(names), validator)
+        with self._lock:
+            specs = dict(self._specs)
+            specs[code] = spec
+            self._specs = specs
+            if self._source is not None:
+                self._source[code] = training_class
+        return spec
+
+    def _unregister(self, code: str) -> None:
+        """Удалить описание кода, которого больше нет в источнике."""
+        with self._lock:
+            specs = dict(self._specs)
+            specs.pop(code, None)
+            self._specs = specs
+
+    def get(self, code: str) -> Optional[WorkoutSpec]:
+        """Получить описание вида тренировки без учёта в счётчиках."""
+        spec = self._specs.get(code)
+        if self._source is None:
+            return spec
+        training_class = self._source.get(code)
+        if spec is not None and spec.constructor is training_class:
+            return spec
+        if training_class is None:
+            if spec is not None:
+                self._unregister(code)
+            return None
+        return self.register(code, training_class)
+
+    def lookup(self, code: str) -> WorkoutSpec:
+        """Получить описание вида тренировки для обработки пакета."""
+        spec = self.get(code)
+        if spec is None:
+            self.misses += 1
+            raise ValueError(
+                UNEXPECTED_TYPE
+                .format(workout_key=code)
+            )
+        self.counts[code] += 1
+        return spec
+
+    def stats(self) -> Dict[str, Any]:
+        """Вернуть число попаданий, промахов и обращений по видам."""
+        return {
+            'hits': sum(self.counts.values()),
+            'misses': self.misses,
+            'counts': dict(self.counts)
+        }
+
+    def reset_stats(self) -> None:
+        """Обнулить счётчики."""
+        self.misses = 0
+        self.counts.clear()
+
+
+WORKOUTS = WorkoutRegistry(TRAINING_TYPES)
+
+
+def register_training(code: str, training_class: type,
+                      validator: Optional[Validator] = None) -> WorkoutSpec:
+    """Добавить новый вид тренировки во время работы программы.
+
+    `validator` получает данные пакета после проверки числа параметров
+    и должен выбросить `ValueError`, если они некорректны.
+    """
+    return WORKOUTS.register(code, training_class, validator)
 
 
 def read_package(workout_type: str, data) -> Training:
     """Прочитать данные полученные от датчиков."""
-    if workout_type not in TRAINING_TYPES:
+    spec = WORKOUTS.lookup(workout_type)
+    if len(data) != spec.arity:
+        raise ValueError(
+            ERROR_CHECKING_PARAMETERS_COUNT
+            .format(workout_key=workout_type, count_params=len(data))
+        )
+    if spec.validator is not None:
+        spec.validator(data)
+    return spec.constructor(*data)
+
+
+PACKAGE_OK = 0
+PACKAGE_UNKNOWN_TYPE = 1
+PACKAGE_WRONG_ARITY = 2
+PACKAGE_NOT_NUMBER = 3
+PACKAGE_OUT_OF_RANGE = 4
+PACKAGE_ZERO_DURATION = 5
+POSITIVE_FIELDS = frozenset(('weight', 'height', 'length_pool'))
+
+
+def _check_values(spec: WorkoutSpec, data: Sequence[Any]) -> int:
+    """Проверить значения пакета известного вида и длины."""
+    for name, value in zip(spec.field_names, data):
+        if not isinstance(value, numbers.Real) or isinstance(value, bool):
+            return PACKAGE_NOT_NUMBER
+        if name == 'duration' and value == 0:
+            return PACKAGE_ZERO_DURATION
+        try:
+            finite = math.isfinite(value)
+        except OverflowError:
+            # Целое, которое не помещается во float.
+            return PACKAGE_OUT_OF_RANGE
+        if not finite or value < 0 or (
+            value == 0 and name in POSITIVE_FIELDS
+        ):
+            return PACKAGE_OUT_OF_RANGE
+    return PACKAGE_OK
+
+
+def check_package(workout_type: str, data: Sequence[Any]) -> int:
+    """Проверить пакет и вернуть код ошибки вместо исключения.
+
+    Код вида тренировки не строкой — неизвестный вид, данные без
+    длины (число, None) — неверное число параметров.
+    """
+    if not isinstance(workout_type, str):
+        return PACKAGE_UNKNOWN_TYPE
+    spec = WORKOUTS.get(workout_type)
+    if spec is None:
+        return PACKAGE_UNKNOWN_TYPE
+    if not isinstance(data, Sized) or len(data) != spec.arity:
+        return PACKAGE_WRONG_ARITY
+    code = _check_values(spec, data)
+    if code == PACKAGE_OK and spec.validator is not None:
+        try:
+            spec.validator(data)
+        except ValueError:
+            return PACKAGE_OUT_OF_RANGE
+    return code
+
+
+def validate_packages(
+    packages: Iterable[Tuple[str, Sequence[Any]]]
+) -> Tuple[List[bool], array]:
+    """Проверить пачку пакетов за один проход без исключений.
+
+    Возвращает маску корректных пакетов и коды ошибок `PACKAGE_*`
+    по строкам. Для пакетов с маской True `read_package` не выбросит
+    исключение, а `get_mean_speed` не разделит на ноль.
+    """
+    codes = array('B', (
+        check_package(workout_type, data) for workout_type, data in packages
+    ))
+    return [code == PACKAGE_OK for code in codes], codes
+
+
+class CachedReader:
+    """Кэш результатов `read_package` + `show_training_info`.
+
+    Ключ — код тренировки и данные пакета, поэтому повторно
+    присланные пакеты не пересчитываются. Хранит не больше `maxsize`
+    записей, вытесняя давно не использованные; при заданном `ttl`
+    записи старше `ttl` секунд считаются отсутствующими.
+    Возвращаемые `InfoMessage` общие для всех повторов и не должны
+    изменяться вызывающим кодом. Кэш можно использовать из нескольких
+    потоков: расчёт идёт вне блокировки.
+    """
+
+    def __init__(self, maxsize: int = 1024,
+                 ttl: Optional[float] = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_info(self, workout_type: str,
+                 data: Sequence[float]) -> InfoMessage:
+        """Получить сообщение о тренировке из кэша или рассчитать его."""
+        key = (workout_type, tuple(data))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (
+                self.ttl is None or now - entry[0] < self.ttl
+            ):
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[1]
+            self.misses += 1
+        message = read_package(workout_type, data).show_training_info()
+        with self._lock:
+            self._entries[key] = (now, message)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return message
+
+    def get_message(self, workout_type: str, data: Sequence[float]) -> str:
+        """Получить строку сообщения о тренировке."""
+        return self.get_info(workout_type, data).get_message()
+
+    def clear(self) -> None:
+        """Очистить кэш и счётчики."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Вернуть число попаданий, промахов, вытеснений и долю попаданий."""
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hit_ratio': self.hits / requests if requests else 0.0
+        }
+
+
+class ResultStore:
+    """Потокобезопасное хранилище сообщений по идентификатору тренировки.
+
+    Ключи распределены по `shards` сегментам со своими блокировками,
+    которые берут только записывающие потоки. Чтение выполняется
+    без блокировок: отдельная операция со словарём атомарна.
+    """
+
+    def __init__(self, shards: int = 16) -> None:
+        self._shards = [({}, threading.Lock()) for _ in range(shards)]
+
+    def _shard(self, workout_id: Any) -> Tuple[Dict[Any, InfoMessage],
+                                               threading.Lock]:
+        """Получить сегмент для идентификатора."""
+        return self._shards[hash(workout_id) % len(self._shards)]
+
+    def __len__(self) -> int:
+        return sum(len(results) for results, _ in self._shards)
+
+    def __contains__(self, workout_id: Any) -> bool:
+        return workout_id in self._shard(workout_id)[0]
+
+    def get(self, workout_id: Any,
+            default: Optional[InfoMessage] = None) -> Optional[InfoMessage]:
+        """Получить сообщение без блокировки."""
+        return self._shard(workout_id)[0].get(workout_id, default)
+
+    def put(self, workout_id: Any, message: InfoMessage) -> None:
+        """Сохранить сообщение, заменив предыдущее."""
+        results, lock = self._shard(workout_id)
+        with lock:
+            results[workout_id] = message
+
+    def put_if_absent(self, workout_id: Any,
+                      message: InfoMessage) -> InfoMessage:
+        """Сохранить сообщение, если его ещё нет, и вернуть хранимое."""
+        results, lock = self._shard(workout_id)
+        with lock:
+            return results.setdefault(workout_id, message)
+
+    def pop(self, workout_id: Any,
+            default: Optional[InfoMessage] = None) -> Optional[InfoMessage]:
+        """Удалить сообщение и вернуть его."""
+        results, lock = self._shard(workout_id)
+        with lock:
+            return results.pop(workout_id, default)
+
+
+class BloomFilter:
+    """Фильтр Блума для 16-байтовых отпечатков.
+
+    Размер битового массива и число хэшей подбираются по ожидаемому
+    числу элементов `capacity` и допустимой доле ложных срабатываний.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2
+        ))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, fingerprint: bytes) -> Iterator[int]:
+        """Получить номера битов отпечатка двойным хэшированием."""
+        first = int.from_bytes(fingerprint[:8], 'little')
+        step = int.from_bytes(fingerprint[8:16], 'little') | 1
+        for number in range(self.hashes):
+            yield (first + number * step) % self.size
+
+    def __contains__(self, fingerprint: bytes) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(fingerprint)
+        )
+
+    def add(self, fingerprint: bytes) -> bool:
+        """Добавить отпечаток и вернуть True, если он, вероятно, уже был."""
+        present = True
+        for position in self._positions(fingerprint):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                present = False
+                self.bits[position >> 3] |= mask
+        return present
+
+
+class Deduplicator:
+    """Отсев повторно присланных пакетов перед `read_package`.
+
+    Отпечаток пакета — хэш устройства (или сессии), кода тренировки
+    и данных. Последние `exact_size` отпечатков проверяются точно,
+    более старые — фильтром Блума на `capacity` пакетов с долей
+    ложных срабатываний `error_rate`, поэтому память ограничена.
+    Для нового дня фильтр сбрасывается методом `reset`.
+
+    Срабатывание фильтра для старого отпечатка подтверждается по
+    точному хранилищу `store` (множество или объект с `in` и `add`,
+    например на диске). Без хранилища такой пакет по умолчанию
+    пропускается: его повтор не отсеивается. С `drop_probable=True`
+    он отбрасывается без проверки, и примерно доля `error_rate`
+    новых пакетов теряется как ложные повторы.
+    """
+
+    def __init__(self, capacity: int = 10_000_000,
+                 error_rate: float = 0.001,
+                 exact_size: int = 100_000,
+                 store: Optional[MutableSet[bytes]] = None,
+                 drop_probable: bool = False) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.exact_size = exact_size
+        self.store = store
+        self.drop_probable = drop_probable
+        self.reset()
+
+    def reset(self) -> None:
+        """Очистить фильтр, точный буфер, хранилище и счётчики."""
+        self.bloom = BloomFilter(self.capacity, self.error_rate)
+        self._recent: OrderedDict = OrderedDict()
+        if self.store is not None:
+            self.store.clear()
+        self.seen = 0
+        self.exact_duplicates = 0
+        self.probable_duplicates = 0
+        self.probable_kept = 0
+
+    @staticmethod
+    def fingerprint(device_id: Any, workout_type: str,
+                    data: Sequence[float]) -> bytes:
+        """Получить отпечаток пакета."""
+        import hashlib
+
+        return hashlib.blake2b(
+            repr((device_id, workout_type, tuple(data))).encode(),
+            digest_size=16
+        ).digest()
+
+    def is_duplicate(self, device_id: Any, workout_type: str,
+                     data: Sequence[float]) -> bool:
+        """Проверить пакет и запомнить его отпечаток."""
+        fingerprint = self.fingerprint(device_id, workout_type, data)
+        self.seen += 1
+        if fingerprint in self._recent:
+            self._recent.move_to_end(fingerprint)
+            self.exact_duplicates += 1
+            return True
+        self._recent[fingerprint] = None
+        if len(self._recent) > self.exact_size:
+            self._recent.popitem(last=False)
+        if not self.bloom.add(fingerprint):
+            if self.store is not None:
+                self.store.add(fingerprint)
+            return False
+        if self.store is not None:
+            if fingerprint in self.store:
+                self.exact_duplicates += 1
+                return True
+            self.store.add(fingerprint)
+        elif self.drop_probable:
+            self.probable_duplicates += 1
+            return True
+        else:
+            self.probable_kept += 1
+        return False
+
+    def filter(self, packages: Iterable[Tuple[Any, str, Sequence[float]]]
+               ) -> Iterator[Tuple[str, Sequence[float]]]:
+        """Отдать пакеты (код, данные) без повторов."""
+        for device_id, workout_type, data in packages:
+            if not self.is_duplicate(device_id, workout_type, data):
+                yield workout_type, data
+
+    def stats(self) -> Dict[str, Any]:
+        """Вернуть число пакетов, отсеянных повторов и размер фильтра.
+
+        `probable_kept` — пропущенные пакеты, которые фильтр счёл
+        повторами, но подтвердить их было не по чему.
+        """
+        dropped = self.exact_duplicates + self.probable_duplicates
+        return {
+            'seen': self.seen,
+            'unique': self.seen - dropped,
+            'dropped': dropped,
+            'exact_duplicates': self.exact_duplicates,
+            'probable_duplicates': self.probable_duplicates,
+            'probable_kept': self.probable_kept,
+            'bloom_bytes': len(self.bloom.bits),
+            'bloom_hashes': self.bloom.hashes
+        }
+
+
+Columns = Tuple[Sequence[Any], Sequence[Any], Sequence[Any]]
+PRECISIONS = ('double', 'single', 'decimal')
+PRECISION_TYPECODES = {'double': 'd', 'single': 'f'}
+PRECISION_TOLERANCE = 0.0005  # Половина единицы последнего знака `.3f`.
+PrecisionTypes = Tuple[Callable[[Any], Any], Callable[[], Any]]
+
+
+def _precision_types(precision: str) -> PrecisionTypes:
+    """Вернуть преобразование чисел и фабрику колонок для режима.
+
+    `double` и `single` считают во float и хранят результат в
+    `array('d')` и `array('f')`, `decimal` считает в `Decimal`
+    по десятичной записи чисел и возвращает списки.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(
+            UNEXPECTED_PRECISION
+            .format(precision=precision)
+        )
+    if precision == 'decimal':
+        from decimal import Decimal
+        return (lambda value: Decimal(str(value))), list
+    return float, partial(array, PRECISION_TYPECODES[precision])
+
+
+def _running_batch(action, duration, weight,
+                   number=float, column=partial(array, 'd')) -> Columns:
+    """Рассчитать дистанцию, скорость и калории для колонок бега."""
+    len_step, m_in_km = number(Running.LEN_STEP), number(Running.M_IN_KM)
+    hours_to_minutes = number(Running.HOURS_TO_MINUTES)
+    multiplying = number(Running.MULTIPLYING_MEAN_SPEED)
+    decreasing = number(Running.DECREASING_MEAN_SPEED)
+    distances, speeds, calories = column(), column(), column()
+    for action_, duration_, weight_ in zip(action, duration, weight):
+        distance = action_ * len_step / m_in_km
+        speed = distance / duration_
+        distances.append(distance)
+        speeds.append(speed)
+        calories.append(
+            (multiplying * speed - decreasing)
+            * weight_ / m_in_km
+            * (duration_ * hours_to_minutes)
+        )
+    return distances, speeds, calories
+
+
+def _walking_batch(action, duration, weight, height,
+                   number=float, column=partial(array, 'd')) -> Columns:
+    """Рассчитать дистанцию, скорость и калории для колонок ходьбы."""
+    len_step = number(SportsWalking.LEN_STEP)
+    m_in_km = number(SportsWalking.M_IN_KM)
+    hours_to_minutes = number(SportsWalking.HOURS_TO_MINUTES)
+    multiplying_weight = number(SportsWalking.MULTIPLYING_WEIGHT)
+    multiplying_speed = number(SportsWalking.MULTIPLYING_MEAN_SPEED)
+    distances, speeds, calories = column(), column(), column()
+    for action_, duration_, weight_, height_ in zip(
+        action, duration, weight, height
+    ):
+        distance = action_ * len_step / m_in_km
+        speed = distance / duration_
+        distances.append(distance)
+        speeds.append(speed)
+        calories.append(
+            (
+                multiplying_weight
+                * weight_
+                + (speed**2 // height_)
+                * multiplying_speed
+                * weight_
+            )
+            * (duration_ * hours_to_minutes)
+        )
+    return distances, speeds, calories
+
+
+def _swimming_batch(action, duration, weight, length_pool, count_pool,
+                    number=float, column=partial(array, 'd')) -> Columns:
+    """Рассчитать дистанцию, скорость и калории для колонок плавания."""
+    len_step, m_in_km = number(Swimming.LEN_STEP), number(Swimming.M_IN_KM)
+    increasing = number(Swimming.INCREASING_MEAN_SPEED)
+    multiplying = number(Swimming.MULTIPLYING_MEAN_SPEED)
+    distances, speeds, calories = column(), column(), column()
+    for action_, duration_, weight_, length_, count_ in zip(
+        action, duration, weight, length_pool, count_pool
+    ):
+        speed = ((length_ * count_) / m_in_km) / duration_
+        distances.append(action_ * len_step / m_in_km)
+        speeds.append(speed)
+        calories.append((speed + increasing) * multiplying * weight_)
+    return distances, speeds, calories
+
+
+# Ключ — класс, формулы которого повторяет функция: подкласс или
+# другой класс под тем же кодом пакетно не считается.
+BATCH_FUNCTIONS = {
+    Running: _running_batch,
+    SportsWalking: _walking_batch,
+    Swimming: _swimming_batch
+}
+
+
+def _batch_spec(workout_type: str) -> Tuple[WorkoutSpec, Callable]:
+    """Найти описание вида тренировки и функцию пакетного расчёта."""
+    spec = WORKOUTS.get(workout_type)
+    if spec is None:
         raise ValueError(
             UNEXPECTED_TYPE
             .format(workout_key=workout_type)
         )
-    class_ = TRAINING_TYPES[workout_type]
-    if len(data) != len(fields(class_)):
+    if spec.constructor not in BATCH_FUNCTIONS:
         raise ValueError(
-            ERROR_CHECKING_PARAMETERS_COUNT
-            .format(workout_key=workout_type, count_params=len(data))
+            NO_BATCH_FUNCTION
+            .format(workout_key=workout_type,
+                    name=getattr(spec.constructor, '__name__', '?'))
         )
-    return class_(*data)
+    return spec, BATCH_FUNCTIONS[spec.constructor]
+
 
+def compute_batch(workout_type: str,
+                  columns: Mapping[str, Sequence[float]],
+                  precision: str = 'double') -> Dict[str, Sequence[Any]]:
+    """Рассчитать показатели сразу для колонок однотипных тренировок.
 
-def main(training: Training) -> None:
-    """Главная функция."""
-    print(training.show_training_info().get_message())
+    Колонки называются так же, как поля класса тренировки
+    (`action`, `duration`, `weight` и дополнительные). В режиме
+    `double` результат совпадает с `show_training_info` для каждой
+    строки, `single` вдвое уменьшает размер колонок результата,
+    `decimal` считает точно по десятичной записи входных данных.
+    """
+    spec, batch_function = _batch_spec(workout_type)
+    number, column = _precision_types(precision)
+    names = spec.field_names
+    for name in names:
+        if name not in columns:
+            raise ValueError(
+                MISSING_COLUMN
+                .format(workout_key=workout_type, column=name)
+            )
+    lengths = {len(columns[name]) for name in names}
+    if len(lengths) > 1:
+        raise ValueError(
+            COLUMNS_LENGTH_MISMATCH
+            .format(workout_key=workout_type, lengths=sorted(lengths))
+        )
+    inputs = [columns[name] for name in names]
+    if precision == 'decimal':
+        inputs = [map(number, values) for values in inputs]
+    distance, speed, calories = batch_function(
+        *inputs, number=number, column=column
+    )
+    return {'distance': distance, 'speed': speed, 'calories': calories}
 
 
-if __name__ == '__main__':
-    packages = [
-        ('SWM', [720, 1, 80, 25, 40]),
-        ('RUN', [15000, 1, 75]),
-        ('WLK', [9000, 1, 75, 180]),
-    ]
+def check_precision(workout_type: str,
+                    columns: Mapping[str, Sequence[float]],
+                    precision: str) -> float:
+    """Проверить, что режим `precision` не меняет вывод `.3f`.
+
+    Сравнивает результат с расчётом в режиме `double` и возвращает
+    наибольшую абсолютную погрешность. Если она больше
+    `PRECISION_TOLERANCE`, выбрасывает `ValueError`.
+    """
+    expected = compute_batch(workout_type, columns)
+    result = compute_batch(workout_type, columns, precision)
+    worst = 0.0
+    for name, values in expected.items():
+        error = max(
+            (abs(float(value) - exact)
+             for value, exact in zip(result[name], values)),
+            default=0.0
+        )
+        if error > PRECISION_TOLERANCE:
+            raise ValueError(PRECISION_LOSS.format(
+                precision=precision, column=name, error=error,
+                tolerance=PRECISION_TOLERANCE
+            ))
+        worst = max(worst, error)
+    return worst
+
+
+class TrainingColumns:
+    """Набор однотипных тренировок, хранящийся по колонкам.
+
+    Каждое поле класса тренировки хранится в своём `array('d')`,
+    поэтому тренировка занимает 8 байт на поле вместо отдельного
+    объекта. Методы повторяют API `Training`, но возвращают колонки.
+    С `precision='single'` поля хранятся в `array('f')` по 4 байта,
+    режим расчёта передаётся в `compute_batch`.
+    """
+
+    def __init__(self, workout_type: str,
+                 precision: str = 'double') -> None:
+        spec, _ = _batch_spec(workout_type)
+        if precision not in PRECISIONS:
+            raise ValueError(
+                UNEXPECTED_PRECISION
+                .format(precision=precision)
+            )
+        self.workout_type = workout_type
+        self.precision = precision
+        self.training_class = spec.constructor
+        typecode = PRECISION_TYPECODES.get(precision, 'd')
+        self.columns = {name: array(typecode) for name in spec.field_names}
+        self._results: Optional[Dict[str, Sequence[Any]]] = None
+
+    def __len__(self) -> int:
+        return len(self.columns['action'])
+
+    def append(self, data: Sequence[float]) -> None:
+        """Добавить тренировку по данным пакета."""
+        if len(data) != len(self.columns):
+            raise ValueError(
+                ERROR_CHECKING_PARAMETERS_COUNT
+                .format(workout_key=self.workout_type, count_params=len(data))
+            )
+        for column, value in zip(self.columns.values(), data):
+            column.append(value)
+        self._results = None
+
+    def extend(self, packages: Iterable[Sequence[float]]) -> None:
+        """Добавить тренировки по данным нескольких пакетов."""
+        for data in packages:
+            self.append(data)
+
+    def _get_results(self) -> Dict[str, Sequence[Any]]:
+        """Рассчитать показатели, если данные изменились."""
+        if self._results is None:
+            self._results = compute_batch(
+                self.workout_type, self.columns, self.precision
+            )
+        return self._results
+
+    def get_distance(self) -> Sequence[Any]:
+        """Получить дистанции в км."""
+        return self._get_results()['distance']
+
+    def get_mean_speed(self) -> Sequence[Any]:
+        """Получить средние скорости движения."""
+        return self._get_results()['speed']
+
+    def get_spent_calories(self) -> Sequence[Any]:
+        """Получить количество затраченных калорий."""
+        return self._get_results()['calories']
+
+    def show_training_info(self) -> List[InfoMessage]:
+        """Вернуть информационные сообщения о выполненных тренировках."""
+        results = self._get_results()
+        return [
+            InfoMessage(self.training_class.__name__, *values)
+            for values in zip(
+                self.columns['duration'],
+                results['distance'],
+                results['speed'],
+                results['calories']
+            )
+        ]
+
+
+SECONDS_IN_HOUR = 3600
+SESSION_FIELDS = frozenset(('action', 'duration', 'weight', 'count_pool'))
+
+
+class TrainingSession:
+    """Тренировка по интервалам от датчиков вместо итогового пакета.
+
+    Каждый интервал сообщает время окончания в секундах, число шагов
+    или гребков и, для плавания, число проплытых бассейнов. Сессия
+    хранит только суммы, поэтому память не зависит от числа интервалов.
+    Показатели считаются классом тренировки из `TRAINING_TYPES` по
+    накопленным суммам, а по достижении `split_km` км дистанции
+    `add_sample` возвращает сообщение об отрезке.
+    """
+
+    def __init__(self, workout_type: str, weight: float, start: float = 0.0,
+                 split_km: float = 1.0, **params: float) -> None:
+        self.spec = WORKOUTS.lookup(workout_type)
+        for name in self.spec.field_names:
+            if name not in SESSION_FIELDS and name not in params:
+                raise ValueError(
+                    MISSING_PARAMETER
+                    .format(workout_key=workout_type, name=name)
+                )
+        self.workout_type = workout_type
+        self.weight = weight
+        self.params = params
+        self.split_km = split_km
+        self.start = self.last = self.split_start = start
+        self.action = self.laps = 0
+        self.split_action = self.split_laps = 0
+
+    def _make_training(self, action: int, seconds: float,
+                       laps: int) -> Training:
+        """Создать тренировку по суммам интервалов."""
+        values = dict(
+            self.params, action=action, duration=seconds / SECONDS_IN_HOUR,
+            weight=self.weight, count_pool=laps
+        )
+        return self.spec.constructor(
+            *(values[name] for name in self.spec.field_names)
+        )
+
+    def add_sample(self, timestamp: float, action: int,
+                   laps: int = 0) -> Optional[InfoMessage]:
+        """Учесть интервал и вернуть сообщение, если отрезок завершён."""
+        if timestamp < self.last:
+            raise ValueError(
+                UNORDERED_SAMPLE
+                .format(timestamp=timestamp, previous=self.last)
+            )
+        self.last = timestamp
+        self.action += action
+        self.laps += laps
+        self.split_action += action
+        self.split_laps += laps
+        constructor = self.spec.constructor
+        split_distance = (
+            self.split_action * constructor.LEN_STEP / constructor.M_IN_KM
+        )
+        if split_distance < self.split_km or timestamp == self.split_start:
+            return None
+        return self._close_split()
+
+    def _close_split(self) -> InfoMessage:
+        """Завершить текущий отрезок."""
+        message = self._make_training(
+            self.split_action, self.last - self.split_start, self.split_laps
+        ).show_training_info()
+        self.split_start = self.last
+        self.split_action = self.split_laps = 0
+        return message
+
+    def finish(self) -> Optional[InfoMessage]:
+        """Вернуть сообщение о последнем незавершённом отрезке."""
+        if self.split_action == 0 or self.last == self.split_start:
+            return None
+        return self._close_split()
+
+    def training(self) -> Training:
+        """Получить тренировку по всем интервалам.
+
+        До первого интервала позже `start` длительность нулевая,
+        и тренировку построить нельзя.
+        """
+        if self.last == self.start:
+            raise ValueError(
+                EMPTY_SESSION
+                .format(workout_key=self.workout_type, start=self.start)
+            )
+        return self._make_training(
+            self.action, self.last - self.start, self.laps
+        )
+
+    def show_training_info(self) -> InfoMessage:
+        """Вернуть информационное сообщение о тренировке целиком."""
+        return self.training().show_training_info()
+
+
+@dataclass
+class WorkoutTotals:
+    """Накопленные итоги по группе тренировок."""
+    count: int = 0
+    duration: float = 0.0
+    distance: float = 0.0
+    speed_sum: float = 0.0
+    calories: float = 0.0
+
+    def add(self, message: InfoMessage) -> None:
+        """Учесть результат одной тренировки."""
+        self.count += 1
+        self.duration += message.duration
+        self.distance += message.distance
+        self.speed_sum += message.speed
+        self.calories += message.calories
+
+    def merge(self, other: 'WorkoutTotals') -> None:
+        """Добавить итоги другой группы тренировок."""
+        self.count += other.count
+        self.duration += other.duration
+        self.distance += other.distance
+        self.speed_sum += other.speed_sum
+        self.calories += other.calories
+
+    def get_mean_speed(self) -> float:
+        """Получить среднюю скорость по тренировкам группы."""
+        return self.speed_sum / self.count if self.count else 0.0
+
+
+SHARD_FIELDS = ('duration', 'distance', 'speed', 'calories')
+
+
+def _add_exact(partials: List[float], value: float) -> None:
+    """Прибавить число к частичным суммам без ошибки округления.
+
+    Алгоритм Шевчука, как в `math.fsum`: точная сумма списка
+    `partials` всегда равна точной сумме всех прибавленных чисел.
+    """
+    count = 0
+    for part in partials:
+        if abs(value) < abs(part):
+            value, part = part, value
+        high = value + part
+        low = part - (high - value)
+        if low:
+            partials[count] = low
+            count += 1
+        value = high
+    partials[count:] = [value]
+
+
+@dataclass
+class ShardTotals:
+    """Сливаемые итоги по виду тренировок.
+
+    Суммы полей хранятся частичными суммами `_add_exact`, поэтому
+    итоги не зависят от порядка тренировок и от того, как они
+    распределены по частям.
+    """
+    count: int = 0
+    sums: Dict[str, List[float]] = field(
+        default_factory=lambda: {name: [] for name in SHARD_FIELDS}
+    )
+    minimum: Dict[str, float] = field(default_factory=dict)
+    maximum: Dict[str, float] = field(default_factory=dict)
+
+    def _add_range(self, name: str, low: float, high: float) -> None:
+        """Учесть диапазон значений поля в минимуме и максимуме."""
+        if self.count == 0 or low < self.minimum[name]:
+            self.minimum[name] = low
+        if self.count == 0 or high > self.maximum[name]:
+            self.maximum[name] = high
+
+    def add(self, message: InfoMessage) -> None:
+        """Учесть результат одной тренировки."""
+        for name in SHARD_FIELDS:
+            value = getattr(message, name)
+            _add_exact(self.sums[name], value)
+            self._add_range(name, value, value)
+        self.count += 1
+
+    def merge(self, other: 'ShardTotals') -> None:
+        """Добавить итоги другой части."""
+        if not other.count:
+            return
+        for name in SHARD_FIELDS:
+            for value in other.sums[name]:
+                _add_exact(self.sums[name], value)
+            self._add_range(name, other.minimum[name], other.maximum[name])
+        self.count += other.count
+
+    def get_sum(self, name: str) -> float:
+        """Получить правильно округлённую сумму поля."""
+        return math.fsum(self.sums[name])
+
+
+@dataclass
+class ShardSummary:
+    """Итоги обработки части пакетов по видам тренировок."""
+    rejects: int = 0
+    totals: Dict[str, ShardTotals] = field(default_factory=dict)
+
+    def add(self, message: InfoMessage) -> None:
+        """Учесть результат одной тренировки."""
+        if message.training_type not in self.totals:
+            self.totals[message.training_type] = ShardTotals()
+        self.totals[message.training_type].add(message)
+
+    def merge(self, other: 'ShardSummary') -> None:
+        """Добавить итоги другой части."""
+        self.rejects += other.rejects
+        for training_type, totals in other.totals.items():
+            if training_type not in self.totals:
+                self.totals[training_type] = ShardTotals()
+            self.totals[training_type].merge(totals)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Представить итоги словарём для JSON без потери точности."""
+        return {
+            'rejects': self.rejects,
+            'totals': {
+                training_type: asdict(totals)
+                for training_type, totals in sorted(self.totals.items())
+            }
+        }
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> 'ShardSummary':
+        """Восстановить итоги из словаря `to_dict`."""
+        return cls(data['rejects'], {
+            training_type: ShardTotals(**totals)
+            for training_type, totals in data['totals'].items()
+        })
+
+    def get_totals(self) -> Dict[str, Dict[str, Any]]:
+        """Получить число тренировок, суммы, минимумы и максимумы полей."""
+        return {
+            training_type: {
+                'count': totals.count,
+                'sum': {name: totals.get_sum(name) for name in SHARD_FIELDS},
+                'min': dict(totals.minimum),
+                'max': dict(totals.maximum)
+            }
+            for training_type, totals in sorted(self.totals.items())
+        }
+
+
+def _week_start(day: 'date') -> 'date':
+    """Получить понедельник недели."""
+    from datetime import timedelta
+
+    return day - timedelta(days=day.weekday())
+
+
+def _month_start(day: 'date') -> 'date':
+    """Получить первое число месяца."""
+    return day.replace(day=1)
+
+
+PERIODS = {
+    'day': lambda day: day,
+    'week': _week_start,
+    'month': _month_start
+}
+Buckets = Dict[str, Dict['date', WorkoutTotals]]
+
+
+class WorkoutAggregator:
+    """Итоги тренировок пользователей по дням, неделям и месяцам.
+
+    Каждая тренировка обновляет по одной корзине на период, поэтому
+    добавление выполняется за O(1). Корзины старше `retention`
+    относительно самой поздней тренировки удаляются, по умолчанию
+    срок хранения — 92 дня.
+    """
+
+    def __init__(self, retention: Optional['timedelta'] = None) -> None:
+        if retention is None:
+            from datetime import timedelta
+
+            retention = timedelta(days=92)
+        self.retention = retention
+        self.latest: Optional['date'] = None
+        self._buckets: Dict[str, Dict[Any, Buckets]] = {
+            period: {} for period in PERIODS
+        }
+
+    def _cutoff(self) -> 'date':
+        """Получить первый день, который ещё хранится."""
+        return self.latest - self.retention
+
+    def add(self, user_id: Any, moment: 'datetime',
+            message: InfoMessage) -> bool:
+        """Учесть тренировку пользователя, завершившуюся в `moment`.
+
+        Возвращает False, если тренировка старше срока хранения.
+        """
+        day = moment.date()
+        if self.latest is None or day > self.latest:
+            self.latest = day
+        cutoff = self._cutoff()
+        if day < cutoff:
+            return False
+        for period, get_start in PERIODS.items():
+            buckets = (
+                self._buckets[period]
+                .setdefault(user_id, {})
+                .setdefault(message.training_type, {})
+            )
+            start = get_start(day)
+            if start not in buckets:
+                buckets[start] = WorkoutTotals()
+                self._evict_buckets(buckets, get_start(cutoff))
+            buckets[start].add(message)
+        return True
+
+    @staticmethod
+    def _evict_buckets(buckets: Dict['date', WorkoutTotals],
+                       oldest: 'date') -> None:
+        """Удалить корзины, начавшиеся раньше `oldest`."""
+        for start in [start for start in buckets if start < oldest]:
+            del buckets[start]
+
+    def evict(self) -> None:
+        """Удалить устаревшие корзины всех пользователей."""
+        if self.latest is None:
+            return
+        cutoff = self._cutoff()
+        for period, users in self._buckets.items():
+            oldest = PERIODS[period](cutoff)
+            for user_id, types in list(users.items()):
+                for training_type, buckets in list(types.items()):
+                    self._evict_buckets(buckets, oldest)
+                    if not buckets:
+                        del types[training_type]
+                if not types:
+                    del users[user_id]
+
+    def _sum(self, period: str, user_id: Any, starts: Iterable['date'],
+             training_type: Optional[str]) -> WorkoutTotals:
+        """Сложить корзины пользователя с заданными началами периода."""
+        types = self._buckets[period].get(user_id, {})
+        if training_type is not None:
+            types = {training_type: types.get(training_type, {})}
+        totals = WorkoutTotals()
+        for start in starts:
+            for buckets in types.values():
+                if start in buckets:
+                    totals.merge(buckets[start])
+        return totals
 
-    for workout_type, data in packages:
-        main(read_package(workout_type, data))
+    def totals(self, user_id: Any, period: str, moment: 'datetime',
+               training_type: Optional[str] = None) -> WorkoutTotals:
+        """Итоги за календарный день, неделю или месяц с `moment`."""
+        if period not in PERIODS:
+            raise ValueError(UNEXPECTED_PERIOD.format(period=period))
+        start = PERIODS[period](moment.date())
+        return self._sum(period, user_id, [start], training_type)
+
+    def sliding(self, user_id: Any, days: int, moment: 'datetime',
+                training_type: Optional[str] = None) -> WorkoutTotals:
+        """Итоги за `days` дней, заканчивающихся днём `moment`."""
+        from datetime import timedelta
+
+        end = moment.date()
+        starts = (end - timedelta(days=shift) for shift in range(days))
+        return self._sum('day', user_id, starts, training_type)
+
+
+class QuantileSketch:
+    """Сливаемый скетч перцентилей с относительной погрешностью.
+
+    Значения раскладываются по логарифмическим корзинам, поэтому
+    оценка перцентиля отличается от точной не больше чем на `accuracy`
+    от её величины, а память зависит от диапазона, а не от числа
+    значений.
+    """
+
+    def __init__(self, accuracy: float = 0.01) -> None:
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive: Counter = Counter()
+        self.negative: Counter = Counter()
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        """Учесть значение."""
+        if math.isnan(value):
+            return
+        self.count += 1
+        if value == 0:
+            self.zeros += 1
+            return
+        index = math.ceil(math.log(abs(value)) / self._log_gamma)
+        (self.positive if value > 0 else self.negative)[index] += 1
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        """Добавить значения другого скетча с той же точностью."""
+        if other.accuracy != self.accuracy:
+            raise ValueError(
+                SKETCH_ACCURACY_MISMATCH
+                .format(accuracy=self.accuracy, other=other.accuracy)
+            )
+        self.positive.update(other.positive)
+        self.negative.update(other.negative)
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def _value(self, index: int) -> float:
+        """Получить середину логарифмической корзины."""
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, quantile: float) -> float:
+        """Оценить значение перцентиля `quantile` от 0 до 1."""
+        if not self.count:
+            return math.nan
+        rank = min(max(quantile, 0.0), 1.0) * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._value(index)
+        return math.nan
+
+
+LEADERBOARD_METRICS = ('calories', 'distance', 'speed')
+BoardKey = Tuple[Any, str, str]
+
+
+class Leaderboard:
+    """Лучшие `k` пользователей и перцентили по видам тренировок.
+
+    Для каждой пары вида тренировки (`InfoMessage.training_type`)
+    и показателя из `LEADERBOARD_METRICS` хранятся лучшие результаты
+    `k` пользователей (по одному на пользователя) и `QuantileSketch`
+    по всем тренировкам. Необязательный `period` (например, начало
+    недели) разделяет таблицы по периодам. Таблицы, собранные в разных
+    процессах, объединяются `merge`.
+
+    Лучшие результаты лежат в словаре пользователь → (значение,
+    номер) и в минимальной куче с ленивым удалением: при улучшении
+    результата старая запись кучи устаревает и удаляется, когда
+    оказывается на вершине.
+    """
+
+    def __init__(self, k: int = 100, accuracy: float = 0.01) -> None:
+        self.k = k
+        self.accuracy = accuracy
+        self._heaps: Dict[BoardKey, List[Tuple[float, int, Any]]] = {}
+        self._members: Dict[BoardKey, Dict[Any, Tuple[float, int]]] = {}
+        self._sketches: Dict[BoardKey, QuantileSketch] = {}
+        self._sequence = 0
+
+    @staticmethod
+    def _clean(heap: List[Tuple[float, int, Any]],
+               members: Dict[Any, Tuple[float, int]]) -> None:
+        """Снять с вершины кучи устаревшие записи."""
+        import heapq
+
+        while heap and members.get(heap[0][2], (None, None))[1] != heap[0][1]:
+            heapq.heappop(heap)
+
+    def _push(self, key: BoardKey, value: float, user_id: Any) -> None:
+        """Учесть результат пользователя, если он попадает в таблицу."""
+        import heapq
+
+        heap = self._heaps.setdefault(key, [])
+        members = self._members.setdefault(key, {})
+        current = members.get(user_id)
+        if current is not None:
+            if value <= current[0]:
+                return
+        elif len(members) >= self.k:
+            self._clean(heap, members)
+            if not heap or value <= heap[0][0]:
+                return
+            del members[heapq.heappop(heap)[2]]
+        self._sequence += 1
+        members[user_id] = (value, self._sequence)
+        heapq.heappush(heap, (value, self._sequence, user_id))
+        if len(heap) > 2 * self.k:
+            heap[:] = [
+                (value, sequence, user_id)
+                for user_id, (value, sequence) in members.items()
+            ]
+            heapq.heapify(heap)
+
+    def _sketch(self, key: BoardKey) -> QuantileSketch:
+        """Получить скетч перцентилей для таблицы."""
+        if key not in self._sketches:
+            self._sketches[key] = QuantileSketch(self.accuracy)
+        return self._sketches[key]
+
+    def add(self, user_id: Any, message: InfoMessage,
+            period: Any = None) -> None:
+        """Учесть результат тренировки пользователя."""
+        for metric in LEADERBOARD_METRICS:
+            key = (period, message.training_type, metric)
+            value = getattr(message, metric)
+            self._push(key, value, user_id)
+            self._sketch(key).add(value)
+
+    @staticmethod
+    def _check_metric(metric: str) -> None:
+        """Проверить, что показатель ведётся в таблицах."""
+        if metric not in LEADERBOARD_METRICS:
+            raise ValueError(UNEXPECTED_METRIC.format(metric=metric))
+
+    def top(self, training_type: str, metric: str, period: Any = None,
+            limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Получить лучших пользователей по убыванию результата.
+
+        Возвращает пары (пользователь, лучшее значение).
+        """
+        self._check_metric(metric)
+        members = self._members.get((period, training_type, metric), {})
+        entries = sorted(
+            ((value, sequence, user_id)
+             for user_id, (value, sequence) in members.items()),
+            reverse=True
+        )[:limit]
+        return [(user_id, value) for value, _, user_id in entries]
+
+    def percentile(self, training_type: str, metric: str, quantile: float,
+                   period: Any = None) -> float:
+        """Оценить перцентиль показателя по всем результатам."""
+        self._check_metric(metric)
+        sketch = self._sketches.get((period, training_type, metric))
+        return math.nan if sketch is None else sketch.quantile(quantile)
+
+    def merge(self, other: 'Leaderboard') -> None:
+        """Добавить таблицы, собранные в другом процессе."""
+        for key, members in other._members.items():
+            for user_id, (value, _) in members.items():
+                self._push(key, value, user_id)
+        for key, sketch in other._sketches.items():
+            self._sketch(key).merge(sketch)
+
+    def drop_period(self, period: Any) -> None:
+        """Удалить таблицы завершённого периода."""
+        for store in (self._heaps, self._members, self._sketches):
+            for key in [key for key in store if key[0] == period]:
+                del store[key]
+
+
+HISTORY_VERSION = 1
+HISTORY_COLUMNS = (
+    'duration', 'distance', 'speed', 'calories',
+    'action', 'weight', 'height', 'length_pool', 'count_pool'
+)
+HISTORY_TYPE_COLUMN = 'type'
+HISTORY_META = 'meta.json'
+MAX_HISTORY_TYPES = 256
+
+
+def _column_path(path: str, name: str) -> str:
+    """Получить путь к файлу колонки истории."""
+    suffix = '.u1' if name == HISTORY_TYPE_COLUMN else '.f8'
+    return os.path.join(path, name + suffix)
+
+
+def _read_history_meta(path: str) -> Dict[str, Any]:
+    """Прочитать описание истории и проверить порядок байт."""
+    with open(os.path.join(path, HISTORY_META), encoding='utf-8') as file:
+        meta = json.load(file)
+    if meta['byteorder'] != sys.byteorder:
+        raise ValueError(
+            UNEXPECTED_BYTEORDER
+            .format(path=path, byteorder=meta['byteorder'])
+        )
+    return meta
+
+
+class HistoryWriter:
+    """Запись истории тренировок в двоичные колонки.
+
+    История — каталог, где каждая колонка лежит в своём файле:
+    `type.u1` хранит номер кода тренировки из `meta.json`, остальные
+    колонки — числа float64 (поля `InfoMessage` и исходные данные
+    пакета, NaN для полей, которых нет у вида тренировки). Запись
+    дописывается в конец существующей истории.
+    """
+
+    def __init__(self, path: str, buffer_size: int = 65536) -> None:
+        self.path = path
+        self.buffer_size = buffer_size
+        os.makedirs(path, exist_ok=True)
+        self.types: List[str] = []
+        if os.path.exists(os.path.join(path, HISTORY_META)):
+            self.types = _read_history_meta(path)['types']
+        self._codes = {code: index for index, code in enumerate(self.types)}
+        self._type_buffer = array('B')
+        self._buffers = {name: array('d') for name in HISTORY_COLUMNS}
+        self._files = {
+            name: open(_column_path(path, name), 'ab')
+            for name in (HISTORY_TYPE_COLUMN,) + HISTORY_COLUMNS
+        }
+
+    def __enter__(self) -> 'HistoryWriter':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _get_code(self, workout_type: str) -> int:
+        """Получить номер кода тренировки, добавив новый при нужде."""
+        if workout_type not in self._codes:
+            if len(self.types) >= MAX_HISTORY_TYPES:
+                raise ValueError(
+                    TOO_MANY_TYPES.format(count=MAX_HISTORY_TYPES)
+                )
+            self._codes[workout_type] = len(self.types)
+            self.types.append(workout_type)
+        return self._codes[workout_type]
+
+    def append(self, workout_type: str,
+               data: Sequence[float]) -> InfoMessage:
+        """Рассчитать тренировку по пакету и добавить её в историю."""
+        message = read_package(workout_type, data).show_training_info()
+        values = dict(zip(WORKOUTS.get(workout_type).field_names, data))
+        values.update(
+            distance=message.distance,
+            speed=message.speed,
+            calories=message.calories
+        )
+        self._type_buffer.append(self._get_code(workout_type))
+        for name, buffer in self._buffers.items():
+            buffer.append(values.get(name, math.nan))
+        if len(self._type_buffer) >= self.buffer_size:
+            self.flush()
+        return message
+
+    def flush(self) -> None:
+        """Записать накопленные строки и описание истории на диск."""
+        buffers = {HISTORY_TYPE_COLUMN: self._type_buffer}
+        buffers.update(self._buffers)
+        for name, buffer in buffers.items():
+            buffer.tofile(self._files[name])
+            del buffer[:]
+            self._files[name].flush()
+        meta = {
+            'version': HISTORY_VERSION,
+            'byteorder': sys.byteorder,
+            'types': self.types
+        }
+        with open(os.path.join(self.path, HISTORY_META), 'w',
+                  encoding='utf-8') as file:
+            json.dump(meta, file)
+
+    def close(self) -> None:
+        """Записать остаток и закрыть файлы колонок."""
+        self.flush()
+        for file in self._files.values():
+            file.close()
+
+
+class HistoryReader:
+    """Чтение истории тренировок через отображение файлов в память.
+
+    `column` возвращает `memoryview` над файлом без копирования данных,
+    поверх него можно построить `numpy.frombuffer(reader.column(...))`.
+    Такие производные объекты должны быть удалены до `close`.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.types: List[str] = _read_history_meta(path)['types']
+        self._maps: List['mmap.mmap'] = []
+        self._views: List[memoryview] = []
+        raw = {
+            name: self._map(name)
+            for name in (HISTORY_TYPE_COLUMN,) + HISTORY_COLUMNS
+        }
+        self.size = min(len(view) for view in raw.values())
+        self._columns = {name: view[:self.size] for name, view in raw.items()}
+        self._views.extend(self._columns.values())
+
+    def __enter__(self) -> 'HistoryReader':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _map(self, name: str) -> memoryview:
+        """Отобразить файл колонки в память."""
+        import mmap
+        import struct
+
+        fmt = 'B' if name == HISTORY_TYPE_COLUMN else 'd'
+        with open(_column_path(self.path, name), 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size == 0:
+                return memoryview(b'').cast(fmt)
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        base = memoryview(mapped)
+        whole = base[:size - size % struct.calcsize(fmt)]
+        view = whole.cast(fmt)
+        self._views.extend((base, whole, view))
+        return view
+
+    def column(self, name: str) -> memoryview:
+        """Получить колонку истории без копирования."""
+        return self._columns[name]
+
+    def messages(self) -> Iterator[InfoMessage]:
+        """Отдать сообщения о тренировках по строкам истории."""
+        names = [TRAINING_TYPES[code].__name__ for code in self.types]
+        columns = [
+            self._columns[name]
+            for name in ('duration', 'distance', 'speed', 'calories')
+        ]
+        for code, *values in zip(self._columns[HISTORY_TYPE_COLUMN],
+                                 *columns):
+            yield InfoMessage(names[code], *values)
+
+    def close(self) -> None:
+        """Освободить представления и закрыть отображения файлов."""
+        for view in reversed(self._views):
+            view.release()
+        for mapped in self._maps:
+            mapped.close()
+        self._views.clear()
+        self._maps.clear()
+
+
+def _parse_number(value: str) -> float:
+    """Преобразовать значение из CSV в число."""
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def _parse_jsonl_record(line: str) -> Tuple[str, List[float]]:
+    """Разобрать строку JSONL вида {"workout_type": ..., "data": [...]}."""
+    record = json.loads(line)
+    return record['workout_type'], record['data']
+
+
+def _parse_csv_record(row: Dict[str, str]) -> Tuple[str, List[float]]:
+    """Разобрать строку CSV с колонкой `workout_type`.
+
+    Остальные непустые колонки в порядке заголовка образуют данные пакета.
+    """
+    workout_type = row.pop('workout_type')
+    return workout_type, [
+        _parse_number(value) for value in row.values() if value
+    ]
+
+
+def _non_blank(stream: Iterable[str]) -> Iterator[str]:
+    """Отдать непустые строки потока."""
+    return (line for line in stream if line.strip())
+
+
+def _csv_records(stream: Iterable[str]) -> Iterator[Dict[str, str]]:
+    """Отдать строки CSV в виде словарей по заголовку."""
+    import csv
+
+    return csv.DictReader(_non_blank(stream))
+
+
+PACKAGE_FORMATS = {
+    'jsonl': (_non_blank, _parse_jsonl_record),
+    'csv': (_csv_records, _parse_csv_record)
+}
+STREAM_ERRORS = (ValueError, KeyError, TypeError, ArithmeticError)
+
+
+def stream_packages(stream: Iterable[str], package_format: str = 'jsonl',
+                    rejects: Optional[TextIO] = None,
+                    start: int = 1) -> Iterator[InfoMessage]:
+    """Лениво прочитать пакеты из потока и вернуть сообщения о тренировках.
+
+    Поток читается по одной записи, поэтому расход памяти не зависит
+    от его длины. Ошибочные записи не прерывают обработку: текст ошибки
+    с номером записи пишется в `rejects`.
+    """
+    if package_format not in PACKAGE_FORMATS:
+        raise ValueError(
+            UNEXPECTED_FORMAT
+            .format(package_format=package_format)
+        )
+    records, parse = PACKAGE_FORMATS[package_format]
+    for number, record in enumerate(records(stream), start):
+        try:
+            message = read_package(*parse(record)).show_training_info()
+        except STREAM_ERRORS as error:
+            if rejects is not None:
+                rejects.write(
+                    REJECTED_RECORD.format(number=number, error=error) + '\n'
+                )
+            continue
+        yield message
+
+
+INFO_FIELDS = ('training_type', 'duration', 'distance', 'speed', 'calories')
+_info_values = attrgetter(*INFO_FIELDS)
+
+
+def _render_jsonl(message: InfoMessage) -> str:
+    """Представить сообщение строкой JSON."""
+    return json.dumps(
+        dict(zip(INFO_FIELDS, _info_values(message))), ensure_ascii=False
+    )
+
+
+def _render_csv(message: InfoMessage) -> str:
+    """Представить сообщение строкой CSV."""
+    return ','.join(str(value) for value in _info_values(message))
+
+
+# Имена функций модуля: их ищут при вызове, поэтому замеры
+# `Instrumentation` могут подменить форматирование.
+OUTPUT_FORMATS = {
+    'text': 'render_message',
+    'jsonl': '_render_jsonl',
+    'csv': '_render_csv'
+}
+OUTPUT_HEADERS = {
+    'csv': ','.join(INFO_FIELDS)
+}
+
+
+def _get_renderer(output: str) -> Callable[[InfoMessage], str]:
+    """Вернуть текущую функцию форматирования для формата `output`."""
+    if output not in OUTPUT_FORMATS:
+        raise ValueError(UNEXPECTED_OUTPUT.format(output=output))
+    return globals()[OUTPUT_FORMATS[output]]
+
+
+def stream_lines(stream: Iterable[str], package_format: str = 'jsonl',
+                 rejects: Optional[TextIO] = None, start: int = 1,
+                 output: str = 'text') -> Iterator[str]:
+    """Лениво прочитать пакеты из потока и вернуть готовые строки.
+
+    `output` задаёт формат строк: текст сообщения, JSON или CSV.
+    """
+    render = _get_renderer(output)
+    for message in stream_packages(stream, package_format, rejects, start):
+        yield render(message)
+
+
+SINK_MAX_RECORDS = 4096
+SINK_FLUSH_INTERVAL = 1.0
+SQLITE_TABLE = 'results'
+
+
+class OutputSink(ABC):
+    """Приёмник сообщений о тренировках с записью пачками.
+
+    Сообщения копятся в буфере и сбрасываются методом `_write_batch`,
+    когда их набралось `max_records` или с прошлого сброса прошло
+    `flush_interval` секунд (время проверяется при записи).
+    """
+
+    def __init__(self, max_records: int = SINK_MAX_RECORDS,
+                 flush_interval: float = SINK_FLUSH_INTERVAL) -> None:
+        if max_records < 1:
+            raise ValueError(
+                UNEXPECTED_SINK_SIZE
+                .format(max_records=max_records)
+            )
+        self.max_records = max_records
+        self.flush_interval = flush_interval
+        self.records = 0
+        self._buffer: List[InfoMessage] = []
+        self._flushed = time.monotonic()
+
+    def __enter__(self) -> 'OutputSink':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def write(self, message: InfoMessage) -> None:
+        """Добавить сообщение в буфер и сбросить его при нужде."""
+        self._buffer.append(message)
+        if (len(self._buffer) >= self.max_records
+                or time.monotonic() - self._flushed >= self.flush_interval):
+            self.flush()
+
+    def write_many(self, messages: Iterable[InfoMessage]) -> None:
+        """Добавить в буфер несколько сообщений.
+
+        Сообщения добавляются частями до заполнения буфера, время
+        с прошлого сброса проверяется после каждой части.
+        """
+        messages = iter(messages)
+        while True:
+            part = list(islice(messages, self.max_records - len(self._buffer)))
+            if not part:
+                return
+            self._buffer.extend(part)
+            if (len(self._buffer) >= self.max_records
+                    or time.monotonic() - self._flushed
+                    >= self.flush_interval):
+                self.flush()
+
+    def flush(self) -> None:
+        """Записать накопленные сообщения."""
+        if self._buffer:
+            self._write_batch(self._buffer)
+            self.records += len(self._buffer)
+            self._buffer = []
+        self._flushed = time.monotonic()
+
+    @abstractmethod
+    def _write_batch(self, messages: List[InfoMessage]) -> None:
+        """Записать пачку сообщений."""
+
+    def close(self) -> None:
+        """Записать остаток буфера и освободить ресурсы."""
+        self.flush()
+
+
+class MemorySink(OutputSink):
+    """Приёмник, собирающий сообщения в список `messages`."""
+
+    def __init__(self, max_records: int = SINK_MAX_RECORDS,
+                 flush_interval: float = SINK_FLUSH_INTERVAL) -> None:
+        super().__init__(max_records, flush_interval)
+        self.messages: List[InfoMessage] = []
+
+    def _write_batch(self, messages: List[InfoMessage]) -> None:
+        self.messages.extend(messages)
+
+
+class FileSink(OutputSink):
+    """Приёмник, дописывающий строки в файл в формате `output`.
+
+    Пачка строк кодируется в UTF-8 и записывается одним вызовом
+    `write`. В пустой файл CSV сначала пишется заголовок.
+    """
+
+    def __init__(self, path: str, output: str = 'text',
+                 max_records: int = SINK_MAX_RECORDS,
+                 flush_interval: float = SINK_FLUSH_INTERVAL) -> None:
+        _get_renderer(output)
+        super().__init__(max_records, flush_interval)
+        self.path = path
+        self.output = output
+        self._header = (
+            OUTPUT_HEADERS[output] + '\n' if output in OUTPUT_HEADERS else ''
+        ).encode()
+        self._file = self._open()
+
+    def _open(self) -> BinaryIO:
+        """Открыть файл на дозапись и записать заголовок в пустой файл."""
+        file = open(self.path, 'ab')
+        if not file.tell():
+            file.write(self._header)
+        return file
+
+    def _write_batch(self, messages: List[InfoMessage]) -> None:
+        self._file.write(
+            (
+                '\n'.join(map(_get_renderer(self.output), messages)) + '\n'
+            ).encode()
+        )
+        self._file.flush()
+
+    def close(self) -> None:
+        super().close()
+        self._file.close()
+
+
+class RotatingFileSink(FileSink):
+    """Приёмник с ротацией файла по размеру.
+
+    Когда следующая строка не помещается в `max_bytes`, файл
+    переименовывается в `path.1` (старые копии сдвигаются до
+    `path.{backup_count}`, последняя удаляется) и запись продолжается
+    в новый файл.
+    """
+
+    def __init__(self, path: str, output: str = 'text',
+                 max_bytes: int = 64 * 1024 * 1024, backup_count: int = 5,
+                 max_records: int = SINK_MAX_RECORDS,
+                 flush_interval: float = SINK_FLUSH_INTERVAL) -> None:
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        super().__init__(path, output, max_records, flush_interval)
+        self._size = self._file.tell()
+
+    def _rotate(self) -> None:
+        """Сдвинуть резервные копии и начать новый файл."""
+        self._file.close()
+        for number in range(self.backup_count - 1, 0, -1):
+            source = '{}.{}'.format(self.path, number)
+            if os.path.exists(source):
+                os.replace(source, '{}.{}'.format(self.path, number + 1))
+        if self.backup_count:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self._file = self._open()
+        self._size = self._file.tell()
+
+    def _write_batch(self, messages: List[InfoMessage]) -> None:
+        part: List[bytes] = []
+        size = self._size
+        render = _get_renderer(self.output)
+        for message in messages:
+            line = (render(message) + '\n').encode()
+            if size + len(line) > self.max_bytes and size > len(self._header):
+                self._file.write(b''.join(part))
+                self._rotate()
+                part, size = [], self._size
+            part.append(line)
+            size += len(line)
+        self._file.write(b''.join(part))
+        self._file.flush()
+        self._size = size
+
+
+class SQLiteSink(OutputSink):
+    """Приёмник, добавляющий сообщения в таблицу SQLite.
+
+    Таблица с колонками `INFO_FIELDS` создаётся при нужде, пачка
+    добавляется одним `executemany` в одной транзакции.
+    """
+
+    def __init__(self, path: str, table: str = SQLITE_TABLE,
+                 max_records: int = SINK_MAX_RECORDS,
+                 flush_interval: float = SINK_FLUSH_INTERVAL) -> None:
+        if not table.isidentifier():
+            raise ValueError(UNEXPECTED_TABLE.format(table=table))
+        super().__init__(max_records, flush_interval)
+        import sqlite3
+        self.path = path
+        self.table = table
+        self._connection = sqlite3.connect(path)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS {table} ('
+                'training_type TEXT, duration REAL, distance REAL, '
+                'speed REAL, calories REAL)'.format(table=table)
+            )
+        self._insert = 'INSERT INTO {table} VALUES (?, ?, ?, ?, ?)'.format(
+            table=table
+        )
+
+    def _write_batch(self, messages: List[InfoMessage]) -> None:
+        with self._connection:
+            self._connection.executemany(
+                self._insert, map(_info_values, messages)
+            )
+
+    def close(self) -> None:
+        super().close()
+        self._connection.close()
+
+
+Chunk = Tuple[str, str, int, List[str]]
+
+
+def _read_chunks(stream: Iterable[str], package_format: str, output: str,
+                 chunk_size: int) -> Iterator[Chunk]:
+    """Разбить поток на части по `chunk_size` непустых строк.
+
+    Каждая часть CSV получает копию заголовка, а номер первой записи
+    части совпадает с нумерацией последовательной обработки.
+    """
+    lines = _non_blank(stream)
+    header = [next(lines, '')] if package_format == 'csv' else []
+    start = 1
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield package_format, output, start, header + chunk
+        start += len(chunk)
+
+
+def _process_chunk(chunk: Chunk) -> Tuple[List[str], str]:
+    """Обработать часть входного потока в рабочем процессе."""
+    package_format, output, start, lines = chunk
+    rejects = io.StringIO()
+    return (
+        list(stream_lines(lines, package_format, rejects, start, output)),
+        rejects.getvalue()
+    )
+
+
+def _pop_result(pending: deque, ordered: bool,
+                rejects: Optional[TextIO]) -> List[str]:
+    """Забрать строки первой (или первой готовой) части, записав ошибки."""
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    future = pending[0]
+    if not ordered:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        future = next(future for future in pending if future in done)
+    pending.remove(future)
+    lines, rejected = future.result()
+    if rejects is not None:
+        rejects.write(rejected)
+    return lines
+
+
+def process_parallel(stream: Iterable[str], package_format: str = 'jsonl',
+                     rejects: Optional[TextIO] = None,
+                     workers: Optional[int] = None,
+                     chunk_size: int = 10000,
+                     ordered: bool = True, output: str = 'text',
+                     executor_class: Optional[type] = None) -> Iterator[str]:
+    """Обработать пакеты из потока в нескольких процессах.
+
+    Поток делится на части по `chunk_size` записей, в обработке
+    одновременно находится не больше двух частей на процесс. При
+    `ordered=True` строки и ошибки выдаются в порядке входных данных
+    и побайтно совпадают с результатом `stream_lines`. Вместо
+    процессов можно передать `executor_class=ThreadPoolExecutor`.
+    """
+    if package_format not in PACKAGE_FORMATS:
+        raise ValueError(
+            UNEXPECTED_FORMAT
+            .format(package_format=package_format)
+        )
+    if output not in OUTPUT_FORMATS:
+        raise ValueError(UNEXPECTED_OUTPUT.format(output=output))
+    if chunk_size < 1:
+        raise ValueError(
+            UNEXPECTED_CHUNK_SIZE
+            .format(chunk_size=chunk_size)
+        )
+    if executor_class is None:
+        from concurrent.futures import ProcessPoolExecutor
+        executor_class = ProcessPoolExecutor
+    workers = workers or os.cpu_count() or 1
+    chunks = _read_chunks(stream, package_format, output, chunk_size)
+    pending = deque()
+    with executor_class(workers) as executor:
+        for chunk in chunks:
+            pending.append(executor.submit(_process_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                yield from _pop_result(pending, ordered, rejects)
+        while pending:
+            yield from _pop_result(pending, ordered, rejects)
+
+
+SHARD_INPUT = 'shard-{number}.jsonl'
+SHARD_OUTPUT = 'shard-{number}.json'
+
+
+def _shard_number(line: str, shards: int) -> int:
+    """Выбрать часть для пакета по хешу поля `user`.
+
+    Пакеты без пользователя и некорректные строки распределяются
+    по хешу самой строки, их ошибки находит рабочий процесс.
+    """
+    import zlib
+
+    try:
+        user = json.loads(line).get('user')
+    except (ValueError, AttributeError):
+        user = None
+    key = line if user is None else str(user)
+    return zlib.crc32(key.encode()) % shards
+
+
+def run_shard(input_path: str, output_path: str) -> None:
+    """Обработать часть пакетов JSONL и записать её итоги в JSON.
+
+    Функция работает только с файлами, поэтому её можно запускать
+    в отдельном процессе или на другом узле с общим каталогом.
+    """
+    summary = ShardSummary()
+    rejects = _CountingWriter()
+    with open(input_path, encoding='utf-8') as stream:
+        for message in stream_packages(stream, 'jsonl', rejects):
+            summary.add(message)
+    summary.rejects = rejects.lines
+    with open(output_path, 'w', encoding='utf-8') as file:
+        json.dump(summary.to_dict(), file)
+
+
+def process_sharded(stream: Iterable[str], shards: int,
+                    directory: Optional[str] = None,
+                    workers: Optional[int] = None,
+                    executor_class: Optional[type] = None) -> ShardSummary:
+    """Обработать пакеты JSONL в `shards` частях и слить их итоги.
+
+    Координатор раскладывает пакеты по файлам `shard-N.jsonl` по хешу
+    пользователя, запускает `run_shard` для каждой части в отдельном
+    процессе и сливает итоги из файлов `shard-N.json`. Итоги не
+    зависят от числа частей. Без `directory` файлы частей создаются
+    во временном каталоге и удаляются после обработки.
+    """
+    if shards < 1:
+        raise ValueError(
+            UNEXPECTED_SHARDS
+            .format(shards=shards)
+        )
+    if directory is None:
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            return process_sharded(
+                stream, shards, directory, workers, executor_class
+            )
+    if executor_class is None:
+        from concurrent.futures import ProcessPoolExecutor
+        executor_class = ProcessPoolExecutor
+    os.makedirs(directory, exist_ok=True)
+    inputs = [
+        os.path.join(directory, SHARD_INPUT.format(number=number))
+        for number in range(shards)
+    ]
+    outputs = [
+        os.path.join(directory, SHARD_OUTPUT.format(number=number))
+        for number in range(shards)
+    ]
+    files = [open(path, 'w', encoding='utf-8') for path in inputs]
+    try:
+        for line in _non_blank(stream):
+            files[_shard_number(line, shards)].write(line.rstrip('\n') + '\n')
+    finally:
+        for file in files:
+            file.close()
+    workers = workers or min(shards, os.cpu_count() or 1)
+    with executor_class(workers) as executor:
+        list(executor.map(run_shard, inputs, outputs))
+    summary = ShardSummary()
+    for path in outputs:
+        with open(path, encoding='utf-8') as file:
+            summary.merge(ShardSummary.from_dict(json.load(file)))
+    return summary
+
+
+def process_line(line: str) -> str:
+    """Обработать пакет JSONL и вернуть сообщение или текст ошибки."""
+    try:
+        return (
+            read_package(*_parse_jsonl_record(line))
+            .show_training_info()
+            .get_message()
+        )
+    except STREAM_ERRORS as error:
+        return SERVICE_ERROR.format(error=error)
+
+
+MAX_LINE = 2 ** 16
+
+
+def _process_bytes(line: Union[bytes, str]) -> str:
+    """Обработать пакет в байтах; строка не в UTF-8 — тоже ошибка.
+
+    Строку `str` кладёт в очередь `_read_packages`: это готовый ответ.
+    """
+    if isinstance(line, str):
+        return line
+    try:
+        text = line.decode()
+    except UnicodeDecodeError as error:
+        return SERVICE_ERROR.format(error=error)
+    return process_line(text)
+
+
+def _process_lines(lines: List[bytes]) -> bytes:
+    """Обработать пачку пакетов и склеить ответы."""
+    return ''.join(
+        _process_bytes(line) + '\n' for line in lines
+    ).encode()
+
+
+async def _read_packages(reader: 'asyncio.StreamReader',
+                         queue: 'asyncio.Queue', max_line: int) -> None:
+    """Читать пакеты из соединения в ограниченную очередь.
+
+    Пока очередь заполнена, чтение из сокета приостанавливается,
+    и клиент упирается в окно TCP. На строку длиннее `max_line`
+    в очередь кладётся ответ с ошибкой и чтение прекращается: конец
+    такой строки нельзя отличить от следующих пакетов. Прочие ошибки
+    чтения передаются через очередь в `_write_responses`.
+    """
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                await queue.put(line)
+    except ValueError:
+        await queue.put(SERVICE_ERROR.format(
+            error=LINE_TOO_LONG.format(max_line=max_line)
+        ))
+    except Exception as error:
+        await queue.put(error)
+    await queue.put(None)
+
+
+async def _write_responses(writer: 'asyncio.StreamWriter',
+                           queue: 'asyncio.Queue', batch_size: int,
+                           executor: Optional['Executor']) -> None:
+    """Обрабатывать пакеты из очереди пачками и отправлять ответы."""
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    finished = False
+    while not finished:
+        lines = [await queue.get()]
+        while len(lines) < batch_size and not queue.empty():
+            lines.append(queue.get_nowait())
+        if lines[-1] is None:
+            finished = True
+            lines.pop()
+        if lines and isinstance(lines[-1], Exception):
+            raise lines[-1]
+        if executor is None:
+            writer.write(_process_lines(lines))
+        else:
+            writer.write(
+                await loop.run_in_executor(executor, _process_lines, lines)
+            )
+        await writer.drain()
+        # `drain` не ждёт, пока буфер не переполнен, а `queue.get` —
+        # пока очередь не пуста: уступаем циклу событий явно.
+        await asyncio.sleep(0)
+
+
+async def handle_connection(reader: 'asyncio.StreamReader',
+                            writer: 'asyncio.StreamWriter',
+                            max_pending: int = 1000,
+                            batch_size: int = 64,
+                            executor: Optional['Executor'] = None,
+                            max_line: int = MAX_LINE) -> None:
+    """Обслужить соединение: пакет JSONL в строке — сообщение в ответ.
+
+    Пакеты обрабатываются пачками не больше `batch_size`, после каждой
+    пачки управление возвращается циклу событий. С `executor` расчёт
+    пачек выполняется вне цикла событий.
+    """
+    import asyncio
+
+    queue: asyncio.Queue = asyncio.Queue(max_pending)
+    producer = asyncio.ensure_future(
+        _read_packages(reader, queue, max_line)
+    )
+    try:
+        await _write_responses(writer, queue, batch_size, executor)
+    finally:
+        producer.cancel()
+        writer.close()
+
+
+async def serve(host: str = '127.0.0.1', port: int = 8888,
+                path: Optional[str] = None, max_pending: int = 1000,
+                batch_size: int = 64,
+                executor: Optional['Executor'] = None,
+                max_line: int = MAX_LINE) -> 'asyncio.AbstractServer':
+    """Запустить сервис приёма пакетов на TCP-порту или Unix-сокете.
+
+    `max_line` — наибольшая длина строки пакета в байтах.
+    """
+    import asyncio
+
+    handler = partial(
+        handle_connection, max_pending=max_pending,
+        batch_size=batch_size, executor=executor, max_line=max_line
+    )
+    if path is not None:
+        return await asyncio.start_unix_server(
+            handler, path, limit=max_line
+        )
+    return await asyncio.start_server(handler, host, port, limit=max_line)
+
+
+LATENCY_BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5,
+    1e-4, 2.5e-4, 5e-4, 1e-3, 1e-2, 1e-1, 1.0
+)
+
+
+class StageMetrics:
+    """Счётчики и гистограмма задержек одного этапа."""
+    __slots__ = ('calls', 'errors', 'total', 'max', 'buckets')
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, elapsed: float, failed: bool) -> None:
+        """Учесть вызов длительностью `elapsed` секунд."""
+        import bisect
+
+        self.calls += 1
+        self.errors += failed
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+    def percentile(self, quantile: float) -> float:
+        """Оценить перцентиль задержки по верхней границе корзины."""
+        rank = quantile * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Вернуть метрики этапа в виде словаря."""
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_seconds': self.total,
+            'max_seconds': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'buckets': dict(zip(
+                [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                self.buckets
+            ))
+        }
+
+
+class Instrumentation:
+    """Замеры этапов `read_package`, `get_spent_calories` и `get_message`.
+
+    Функции форматирования вывода (`render_message`, `_render_line`
+    и остальные из `OUTPUT_FORMATS`) замеряются как этап `render`.
+
+    `enable` подменяет функции обёртками, которые считают вызовы,
+    ошибки и задержки по видам тренировок, а `disable` возвращает
+    исходные функции, так что выключенные замеры ничего не стоят.
+    """
+
+    def __init__(self) -> None:
+        self.metrics: Dict[Tuple[str, str], StageMetrics] = {}
+        self._originals: List[Tuple[Any, str, Callable]] = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._originals)
+
+    def record(self, stage: str, workout_type: str, elapsed: float,
+               failed: bool = False) -> None:
+        """Учесть вызов этапа для вида тренировки."""
+        key = (stage, workout_type)
+        if key not in self.metrics:
+            self.metrics[key] = StageMetrics()
+        self.metrics[key].observe(elapsed, failed)
+
+    def _wrap(self, owner: Any, name: str,
+              get_label: Callable[[tuple, dict], str],
+              stage: Optional[str] = None) -> None:
+        """Подменить `owner.name` обёрткой с замером этапа `stage`.
+
+        `get_label` получает позиционные и именованные аргументы вызова
+        и возвращает вид тренировки для метрик.
+        """
+        original = vars(owner)[name]
+        record = self.record
+        stage = stage or name
+
+        @wraps(original)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = original(*args, **kwargs)
+            except Exception:
+                record(stage, get_label(args, kwargs),
+                       time.perf_counter() - started, True)
+                raise
+            record(stage, get_label(args, kwargs),
+                   time.perf_counter() - started)
+            return result
+
+        setattr(owner, name, wrapper)
+        self._originals.append((owner, name, original))
+
+    def enable(self) -> None:
+        """Включить замеры."""
+        if self.enabled:
+            return
+        by_class = {class_: code for code, class_ in TRAINING_TYPES.items()}
+        by_name = {
+            class_.__name__: code for class_, code in by_class.items()
+        }
+        self._wrap(
+            sys.modules[__name__], 'read_package',
+            lambda args, kwargs: str(
+                args[0] if args else kwargs.get('workout_type')
+            )
+        )
+        for class_ in by_class:
+            for name in ('_spent_calories', 'get_spent_calories'):
+                if name in vars(class_):
+                    self._wrap(
+                        class_, name,
+                        lambda args, kwargs: by_class.get(type(args[0]), ''),
+                        'get_spent_calories'
+                    )
+        get_label = (
+            lambda args, kwargs: by_name.get(args[0].training_type, '')
+        )
+        self._wrap(InfoMessage, 'get_message', get_label)
+        # `stream_lines`, `render_many` и приёмники форматируют
+        # сообщения без `get_message`.
+        module = sys.modules[__name__]
+        for name in ('_render_line', *OUTPUT_FORMATS.values()):
+            self._wrap(module, name, get_label, 'render')
+
+    def disable(self) -> None:
+        """Выключить замеры и вернуть исходные функции."""
+        while self._originals:
+            owner, name, original = self._originals.pop()
+            setattr(owner, name, original)
+
+    def reset(self) -> None:
+        """Обнулить накопленные метрики."""
+        self.metrics.clear()
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """Вернуть метрики по этапам и видам тренировок."""
+        result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for (stage, workout_type), metrics in sorted(self.metrics.items()):
+            result.setdefault(stage, {})[workout_type] = metrics.snapshot()
+        return result
+
+    def dump_json(self, path: str) -> None:
+        """Сохранить метрики в JSON."""
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot(), file, indent=2)
+
+    def to_prometheus(self) -> str:
+        """Вернуть метрики в текстовом формате Prometheus."""
+        bounds = [repr(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+        items = [
+            (f'stage="{stage}",workout_type="{workout_type}"', metrics)
+            for (stage, workout_type), metrics in sorted(self.metrics.items())
+        ]
+        lines = ['# TYPE homework_stage_seconds histogram']
+        for labels, metrics in items:
+            cumulative = 0
+            for bound, count in zip(bounds, metrics.buckets):
+                cumulative += count
+                lines.append(
+                    f'homework_stage_seconds_bucket{{{labels},le="{bound}"}}'
+                    f' {cumulative}'
+                )
+            lines.append(f'homework_stage_seconds_sum{{{labels}}} '
+                         f'{metrics.total!r}')
+            lines.append(f'homework_stage_seconds_count{{{labels}}} '
+                         f'{metrics.calls}')
+        lines.append('# TYPE homework_stage_errors_total counter')
+        for labels, metrics in items:
+            lines.append(f'homework_stage_errors_total{{{labels}}} '
+                         f'{metrics.errors}')
+        return '\n'.join(lines) + '\n'
+
+    def dump_prometheus(self, path: str) -> None:
+        """Сохранить метрики в текстовом формате Prometheus."""
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(self.to_prometheus())
+
+
+INSTRUMENTATION = Instrumentation()
+
+
+def main(training: Training, sink: Optional[OutputSink] = None) -> None:
+    """Главная функция.
+
+    С приёмником `sink` сообщение записывается в него, а не в stdout.
+    """
+    if sink is None:
+        print(training.show_training_info().get_message())
+    else:
+        sink.write(training.show_training_info())
+
+
+class _CountingWriter:
+    """Поток, считающий записанные в него строки.
+
+    Без `target` строки только считаются и никуда не пишутся.
+    """
+
+    def __init__(self, target: Optional[TextIO] = None) -> None:
+        self.target = target
+        self.lines = 0
+
+    def write(self, text: str) -> int:
+        self.lines += text.count('\n')
+        if self.target is None:
+            return len(text)
+        return self.target.write(text)
+
+
+def _input_paths(patterns: Sequence[str]) -> List[str]:
+    """Раскрыть шаблоны glob входных файлов.
+
+    `-` означает stdin, шаблон без совпадений остаётся как есть.
+    """
+    import glob
+
+    paths: List[str] = []
+    for pattern in patterns:
+        matched = [pattern] if pattern == '-' else sorted(glob.glob(pattern))
+        paths.extend(matched or [pattern])
+    return paths
+
+
+def _input_lines(paths: Sequence[str],
+                 package_format: str) -> Iterator[str]:
+    """Отдать строки всех входных файлов подряд.
+
+    У второго и следующих файлов CSV пропускается заголовок.
+    """
+    for number, path in enumerate(paths):
+        stream = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        try:
+            lines = _non_blank(stream)
+            if package_format == 'csv' and number:
+                next(lines, None)
+            yield from lines
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+
+def _run_cli(args: 'argparse.Namespace', out: TextIO,
+             rejects: _CountingWriter) -> int:
+    """Обработать входные файлы и вернуть число выведенных строк."""
+    lines = _input_lines(args.paths, args.input_format)
+    if args.mode == 'serial':
+        results = stream_lines(lines, args.input_format, rejects,
+                               output=args.output)
+    else:
+        executor_class = None
+        if args.mode == 'thread':
+            from concurrent.futures import ThreadPoolExecutor
+            executor_class = ThreadPoolExecutor
+        results = process_parallel(
+            lines, args.input_format, rejects, args.workers,
+            args.chunk_size, output=args.output,
+            executor_class=executor_class
+        )
+    if args.output in OUTPUT_HEADERS:
+        out.write(OUTPUT_HEADERS[args.output] + '\n')
+    count = 0
+    while True:
+        batch = [line + '\n' for line in islice(results, 1024)]
+        if not batch:
+            return count
+        out.write(''.join(batch))
+        count += len(batch)
+
+
+def parse_args(
+    argv: Optional[Sequence[str]] = None
+) -> 'argparse.Namespace':
+    """Разобрать аргументы командной строки."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Расчёт результатов тренировок по пакетам датчиков.'
+    )
+    parser.add_argument('inputs', nargs='*', default=['-'],
+                        help='файлы или шаблоны glob, `-` — stdin')
+    parser.add_argument('-f', '--input-format', default='jsonl',
+                        choices=sorted(PACKAGE_FORMATS))
+    parser.add_argument('-m', '--mode', default='serial',
+                        choices=('serial', 'thread', 'process'))
+    parser.add_argument('-w', '--workers', type=int,
+                        help='число потоков или процессов')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('-t', '--output', default='text',
+                        choices=sorted(OUTPUT_FORMATS))
+    parser.add_argument('-o', '--out', help='файл результатов')
+    parser.add_argument('--rejects', help='файл отклонённых записей')
+    args = parser.parse_args(argv)
+    # Проверяем файлы до обработки, чтобы не оборвать вывод на середине.
+    args.paths = _input_paths(args.inputs)
+    for path in args.paths:
+        if path != '-' and not (
+            os.path.isfile(path) and os.access(path, os.R_OK)
+        ):
+            parser.error(UNREADABLE_INPUT.format(path=path))
+    return args
+
+
+def cli(argv: Optional[Sequence[str]] = None) -> int:
+    """Точка входа командной строки.
+
+    Итоги обработки выводятся в stderr.
+    """
+    args = parse_args(argv)
+    out = sys.stdout if args.out is None else open(
+        args.out, 'w', encoding='utf-8'
+    )
+    rejects = _CountingWriter(sys.stderr if args.rejects is None else open(
+        args.rejects, 'w', encoding='utf-8'
+    ))
+    started = time.perf_counter()
+    try:
+        count = _run_cli(args, out, rejects)
+    finally:
+        for stream in (out, rejects.target):
+            if stream not in (sys.stdout, sys.stderr):
+                stream.close()
+    seconds = time.perf_counter() - started
+    packages = count + rejects.lines
+    print(SUMMARY.format(
+        packages=packages, rejects=rejects.lines, seconds=seconds,
+        rate=packages / seconds if seconds else 0.0
+    ), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
@@ -1,6 +1,14 @@
+import asyncio
+import dataclasses
+import json
+import math
 import pytest
+import threading
 import types
 import inspect
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from io import StringIO
 from conftest import Capturing
 
 try:
@@ -384,3 +392,1136 @@ def test_main_output(input_data, expected):
     assert get_message_output == expected, (
         'Метод `main` должен печатать результат в консоль.\n'
     )
+
+
+@pytest.mark.parametrize('workout_type, rows', [
+    ('RUN', [[9000, 1, 75], [420, 4, 20], [1206, 12, 6]]),
+    ('WLK', [[9000, 1, 75, 180], [420, 4, 20, 42], [1206, 12, 6, 12]]),
+    ('SWM', [[720, 1, 80, 25, 40], [420, 4, 20, 42, 4],
+             [1206, 12, 6, 12, 6]]),
+])
+def test_compute_batch(workout_type, rows):
+    class_ = homework.TRAINING_TYPES[workout_type]
+    names = [field.name for field in dataclasses.fields(class_)]
+    columns = {name: [row[i] for row in rows] for i, name in enumerate(names)}
+    result = homework.compute_batch(workout_type, columns)
+    for i, row in enumerate(rows):
+        info = class_(*row).show_training_info()
+        assert (
+            result['distance'][i],
+            result['speed'][i],
+            result['calories'][i],
+        ) == (info.distance, info.speed, info.calories), (
+            'Функция `compute_batch` должна давать те же значения, '
+            'что и `show_training_info`.'
+        )
+
+
+@pytest.mark.parametrize('workout_type, columns', [
+    ('XXX', {}),
+    ('RUN', {'action': [1], 'duration': [1]}),
+    ('RUN', {'action': [1], 'duration': [1], 'weight': [1, 2]}),
+])
+def test_compute_batch_errors(workout_type, columns):
+    with pytest.raises(ValueError):
+        homework.compute_batch(workout_type, columns)
+
+
+def test_compute_batch_registry_changes(monkeypatch):
+    columns = {'action': [15000], 'duration': [1], 'weight': [75]}
+
+    class Trail(homework.Running):
+        LEN_STEP = 0.8
+
+    monkeypatch.setitem(homework.TRAINING_TYPES, 'RUN', Trail)
+    for build in (
+        lambda: homework.compute_batch('RUN', columns),
+        lambda: homework.TrainingColumns('RUN'),
+    ):
+        with pytest.raises(ValueError, match='нет пакетного расчёта'):
+            build()
+    monkeypatch.delitem(homework.TRAINING_TYPES, 'RUN')
+    with pytest.raises(ValueError, match='Неожиданное значение'):
+        homework.compute_batch('RUN', columns)
+    with pytest.raises(ValueError, match='Неожиданное значение'):
+        homework.TrainingColumns('RUN')
+
+
+def test_stream_packages_jsonl():
+    stream = StringIO(
+        '{"workout_type": "SWM", "data": [720, 1, 80, 25, 40]}\n'
+        '\n'
+        '{"workout_type": "XXX", "data": [1, 2, 3]}\n'
+        '{"workout_type": "RUN", "data": [1, 2]}\n'
+        'not json\n'
+        '{"workout_type": "WLK", "data": [9000, 1, 75, 180]}\n'
+    )
+    rejects = StringIO()
+    result = list(homework.stream_lines(stream, rejects=rejects))
+    assert result == [
+        homework.read_package('SWM', [720, 1, 80, 25, 40])
+        .show_training_info().get_message(),
+        homework.read_package('WLK', [9000, 1, 75, 180])
+        .show_training_info().get_message(),
+    ], 'Поток должен содержать сообщения о корректных тренировках.'
+    errors = rejects.getvalue().splitlines()
+    assert len(errors) == 3, 'Ошибочные записи должны попадать в `rejects`.'
+    assert errors[0] == homework.REJECTED_RECORD.format(
+        number=2, error=homework.UNEXPECTED_TYPE.format(workout_key='XXX')
+    )
+    assert errors[1] == homework.REJECTED_RECORD.format(
+        number=3,
+        error=homework.ERROR_CHECKING_PARAMETERS_COUNT.format(
+            workout_key='RUN', count_params=2
+        )
+    )
+
+
+def test_stream_packages_csv():
+    stream = StringIO(
+        'workout_type,action,duration,weight,height\n'
+        'RUN,15000,1,75,\n'
+        'WLK,9000,1,75,180\n'
+        'RUN,15000,1,,\n'
+    )
+    rejects = StringIO()
+    result = list(homework.stream_packages(stream, 'csv', rejects))
+    assert [message.training_type for message in result] == [
+        'Running', 'SportsWalking'
+    ], 'CSV должен читаться по колонке `workout_type`.'
+    assert len(rejects.getvalue().splitlines()) == 1
+
+
+def test_stream_packages_unexpected_format():
+    with pytest.raises(ValueError):
+        list(homework.stream_packages(StringIO(), 'xml'))
+
+
+@pytest.mark.parametrize('package_format, text', [
+    ('jsonl',
+        '{"workout_type": "SWM", "data": [720, 1, 80, 25, 40]}\n'
+        '{"workout_type": "XXX", "data": [1, 2, 3]}\n'
+        '\n'
+        '{"workout_type": "RUN", "data": [15000, 1, 75]}\n'
+        '{"workout_type": "RUN", "data": [1206, 12, 6]}\n'
+        '{"workout_type": "WLK", "data": [9000, 1, 75]}\n'
+        '{"workout_type": "WLK", "data": [9000, 1, 75, 180]}\n'),
+    ('csv',
+        'workout_type,action,duration,weight,height\n'
+        'RUN,15000,1,75,\n'
+        'WLK,9000,1,75,180\n'
+        'RUN,15000,1,,\n'
+        'RUN,1206,12,6,\n'
+        'WLK,420,4,20,42\n'),
+])
+def test_process_parallel(package_format, text):
+    serial_rejects, parallel_rejects = StringIO(), StringIO()
+    serial = list(homework.stream_lines(
+        StringIO(text), package_format, serial_rejects
+    ))
+    parallel = list(homework.process_parallel(
+        StringIO(text), package_format, parallel_rejects,
+        workers=2, chunk_size=2
+    ))
+    assert parallel == serial, (
+        'Параллельная обработка должна сохранять порядок строк.'
+    )
+    assert parallel_rejects.getvalue() == serial_rejects.getvalue(), (
+        'Параллельная обработка должна сохранять номера ошибочных записей.'
+    )
+    unordered = homework.process_parallel(
+        StringIO(text), package_format, workers=2, chunk_size=1,
+        ordered=False
+    )
+    assert sorted(unordered) == sorted(serial)
+
+
+def test_process_parallel_chunk_size():
+    with pytest.raises(ValueError):
+        list(homework.process_parallel(StringIO(), chunk_size=0))
+
+
+def test_InfoMessage_slots():
+    info_message = homework.InfoMessage('Running', 1, 2, 3, 4)
+    assert not hasattr(info_message, '__dict__'), (
+        'Класс `InfoMessage` должен хранить поля в `__slots__`.'
+    )
+    assert dataclasses.asdict(info_message)['calories'] == 4
+
+
+@pytest.mark.parametrize('workout_type, rows', [
+    ('RUN', [[9000, 1, 75], [1206, 12, 6]]),
+    ('WLK', [[9000, 1, 75, 180], [420, 4, 20, 42]]),
+    ('SWM', [[720, 1, 80, 25, 40], [1206, 12, 6, 12, 6]]),
+])
+def test_TrainingColumns(workout_type, rows):
+    trainings = homework.TrainingColumns(workout_type)
+    trainings.extend(rows)
+    assert len(trainings) == len(rows)
+    expected = [
+        homework.read_package(workout_type, row).show_training_info()
+        for row in rows
+    ]
+    assert trainings.show_training_info() == expected, (
+        'Метод `show_training_info` класса `TrainingColumns` должен '
+        'совпадать с результатами отдельных тренировок.'
+    )
+    assert list(trainings.get_spent_calories()) == [
+        message.calories for message in expected
+    ]
+    with pytest.raises(ValueError):
+        trainings.append([1, 2])
+
+
+@pytest.mark.parametrize('input_data', [
+    ['Swimming', 1, 75, 1, 80],
+    ['Running', 12.0, 0.7839, 0.065325, -81.32032799999999],
+    ['SportsWalking', 0.0005, 1e9, float('nan'), -0.0001],
+])
+def test_render_message(input_data):
+    info_message = homework.InfoMessage(*input_data)
+    expected = homework.InfoMessage.MESSAGE.format(
+        **dataclasses.asdict(info_message)
+    )
+    assert homework.render_message(info_message) == expected, (
+        'Функция `render_message` должна совпадать с шаблоном `MESSAGE`.'
+    )
+    out = StringIO()
+    count = homework.render_many([info_message] * 3, out, batch_size=2)
+    assert count == 3
+    assert out.getvalue() == (expected + '\n') * 3, (
+        'Функция `render_many` должна писать по сообщению в строке.'
+    )
+
+
+def test_get_message_subclass_template():
+    class ShortMessage(homework.InfoMessage):
+        MESSAGE = '{training_type}: {calories:.1f} ккал'
+
+    values = ['Swimming', 1, 75, 1, 80]
+    assert ShortMessage(*values).get_message() == 'Swimming: 80.0 ккал', (
+        'Метод `get_message` должен использовать `MESSAGE` подкласса.'
+    )
+    assert homework.InfoMessage(*values).get_message() == (
+        homework.render_message(homework.InfoMessage(*values))
+    )
+
+
+def test_read_package_registry(monkeypatch):
+    def no_reflection(*args):
+        raise AssertionError('`read_package` не должна вызывать `fields`.')
+
+    registry = homework.WorkoutRegistry(homework.TRAINING_TYPES)
+    monkeypatch.setattr(homework, 'WORKOUTS', registry)
+    monkeypatch.setattr(homework, 'fields', no_reflection)
+    homework.read_package('RUN', [15000, 1, 75])
+    homework.read_package('RUN', [15000, 1, 75])
+    homework.read_package('SWM', [720, 1, 80, 25, 40])
+    with pytest.raises(ValueError):
+        homework.read_package('XXX', [1, 2, 3])
+    assert registry.stats() == {
+        'hits': 3, 'misses': 1, 'counts': {'RUN': 2, 'SWM': 1}
+    }, 'Реестр должен считать попадания, промахи и обращения по видам.'
+
+
+def test_register_training(monkeypatch):
+    @dataclasses.dataclass
+    class Cycling(homework.Training):
+        """Тренировка: велосипед."""
+        LEN_STEP = 5.0
+
+        def get_spent_calories(self) -> float:
+            return self.duration * self.weight
+
+    def check_weight(data):
+        if data[2] <= 0:
+            raise ValueError('Вес должен быть положительным')
+
+    monkeypatch.setattr(homework, 'TRAINING_TYPES',
+                        dict(homework.TRAINING_TYPES))
+    monkeypatch.setattr(homework, 'WORKOUTS',
+                        homework.WorkoutRegistry(homework.TRAINING_TYPES))
+    homework.register_training('CYC', Cycling, check_weight)
+    training = homework.read_package('CYC', [1000, 2, 70])
+    assert isinstance(training, Cycling), (
+        'Зарегистрированный вид тренировки должен читаться `read_package`.'
+    )
+    assert homework.TRAINING_TYPES['CYC'] is Cycling
+    with pytest.raises(ValueError):
+        homework.read_package('CYC', [1000, 2, 0])
+
+
+def test_TRAINING_TYPES_in_sync(monkeypatch):
+    @dataclasses.dataclass
+    class Yoga(homework.Training):
+        """Тренировка: йога."""
+
+        def get_spent_calories(self) -> float:
+            return self.duration * self.weight
+
+    monkeypatch.setitem(homework.TRAINING_TYPES, 'YOG', Yoga)
+    assert isinstance(homework.read_package('YOG', [0, 1, 70]), Yoga), (
+        'Вид тренировки, добавленный в `TRAINING_TYPES`, должен читаться.'
+    )
+    monkeypatch.setitem(homework.TRAINING_TYPES, 'RUN', Yoga)
+    assert isinstance(homework.read_package('RUN', [0, 1, 70]), Yoga)
+    monkeypatch.undo()
+    assert isinstance(
+        homework.read_package('RUN', [15000, 1, 75]), homework.Running
+    )
+    with pytest.raises(ValueError):
+        homework.read_package('YOG', [0, 1, 70])
+
+
+def test_WorkoutAggregator():
+    aggregator = homework.WorkoutAggregator(retention=timedelta(days=40))
+    run = homework.read_package('RUN', [15000, 1, 75]).show_training_info()
+    swim = homework.read_package(
+        'SWM', [720, 1, 80, 25, 40]
+    ).show_training_info()
+    monday = datetime(2024, 1, 1, 8)
+    assert aggregator.add('user', monday, run)
+    aggregator.add('user', monday + timedelta(days=1), run)
+    aggregator.add('user', monday + timedelta(days=1), swim)
+    aggregator.add('other', monday, run)
+    week = aggregator.totals('user', 'week', monday + timedelta(days=6))
+    assert week.count == 3, 'Недельные итоги должны включать все тренировки.'
+    assert week.calories == 2 * run.calories + swim.calories
+    running = aggregator.totals('user', 'day', monday, 'Running')
+    assert (running.count, running.distance) == (1, run.distance)
+    sliding = aggregator.sliding('user', 2, monday + timedelta(days=2))
+    assert sliding.count == 2, (
+        'Скользящее окно должно включать только последние дни.'
+    )
+    assert sliding.get_mean_speed() == (run.speed + swim.speed) / 2
+    aggregator.add('user', monday + timedelta(days=45), run)
+    assert not aggregator.add('user', monday, run), (
+        'Тренировки старше срока хранения не должны учитываться.'
+    )
+    assert aggregator.totals('user', 'day', monday).count == 0
+    aggregator.evict()
+    assert aggregator.totals('other', 'day', monday).count == 0
+    assert aggregator.totals('other', 'month', monday).count == 1, (
+        'Месяц, частично попадающий в срок хранения, должен сохраняться.'
+    )
+    with pytest.raises(ValueError):
+        aggregator.totals('user', 'year', monday)
+
+
+async def exchange(server, connect, lines):
+    async with server:
+        reader, writer = await connect()
+        writer.write(''.join(line + '\n' for line in lines).encode())
+        writer.write_eof()
+        responses = (await reader.read()).decode().splitlines()
+        writer.close()
+    return responses
+
+
+def test_serve_tcp():
+    lines = [
+        '{"workout_type": "RUN", "data": [1206, 12, 6]}',
+        '{"workout_type": "XXX", "data": [1, 2, 3]}',
+        '{"workout_type": "WLK", "data": [9000, 1, 75, 180]}',
+    ]
+
+    async def run():
+        server = await homework.serve(port=0, max_pending=1, batch_size=2)
+        port = server.sockets[0].getsockname()[1]
+        return await exchange(
+            server, lambda: asyncio.open_connection('127.0.0.1', port), lines
+        )
+
+    assert asyncio.run(run()) == [
+        homework.process_line(line) for line in lines
+    ], 'Сервис должен отвечать сообщением на каждый пакет по порядку.'
+    assert homework.process_line(lines[1]) == homework.SERVICE_ERROR.format(
+        error=homework.UNEXPECTED_TYPE.format(workout_key='XXX')
+    )
+
+
+def test_serve_not_utf8():
+    line = '{"workout_type": "RUN", "data": [1206, 12, 6]}'
+
+    async def run():
+        server = await homework.serve(port=0, batch_size=1)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(line.encode() + b'\n\xff\xfe\n' + line.encode())
+            writer.write_eof()
+            responses = (await reader.read()).decode().splitlines()
+            writer.close()
+        return responses
+
+    responses = asyncio.run(run())
+    assert len(responses) == 3, (
+        'Строка не в UTF-8 не должна обрывать соединение.'
+    )
+    assert responses[0] == responses[2] == homework.process_line(line)
+    assert responses[1].startswith(homework.SERVICE_ERROR.format(error=''))
+
+
+def test_serve_line_too_long():
+    line = '{"workout_type": "RUN", "data": [1206, 12, 6]}'
+
+    async def run():
+        server = await homework.serve(port=0, max_line=1024)
+        port = server.sockets[0].getsockname()[1]
+        return await asyncio.wait_for(exchange(
+            server, lambda: asyncio.open_connection('127.0.0.1', port),
+            [line, 'x' * 70000, line]
+        ), 5)
+
+    assert asyncio.run(run()) == [
+        homework.process_line(line),
+        homework.SERVICE_ERROR.format(
+            error=homework.LINE_TOO_LONG.format(max_line=1024)
+        )
+    ], 'На слишком длинную строку сервис должен ответить ошибкой.'
+
+
+def test_serve_unix(tmp_path):
+    path = str(tmp_path / 'homework.sock')
+    line = '{"workout_type": "SWM", "data": [720, 1, 80, 25, 40]}'
+
+    async def run():
+        server = await homework.serve(
+            path=path, executor=ThreadPoolExecutor(1)
+        )
+        return await exchange(
+            server, lambda: asyncio.open_unix_connection(path), [line]
+        )
+
+    assert asyncio.run(run()) == [
+        homework.read_package('SWM', [720, 1, 80, 25, 40])
+        .show_training_info().get_message()
+    ]
+
+
+def test_CachedReader(monkeypatch):
+    cache = homework.CachedReader(maxsize=2, ttl=10)
+    first = cache.get_info('RUN', [15000, 1, 75])
+    assert cache.get_info('RUN', (15000, 1, 75)) is first, (
+        'Повторный пакет должен возвращаться из кэша.'
+    )
+    assert cache.get_message('RUN', [15000, 1, 75]) == first.get_message()
+    cache.get_info('WLK', [9000, 1, 75, 180])
+    cache.get_info('SWM', [720, 1, 80, 25, 40])
+    assert len(cache) == 2, 'Кэш не должен превышать `maxsize`.'
+    assert cache.stats() == {
+        'hits': 2, 'misses': 3, 'evictions': 1,
+        'size': 2, 'maxsize': 2, 'hit_ratio': 0.4
+    }
+    now = homework.time.monotonic()
+    monkeypatch.setattr(homework.time, 'monotonic', lambda: now + 11)
+    cache.get_info('SWM', [720, 1, 80, 25, 40])
+    assert cache.stats()['misses'] == 4, (
+        'Устаревшие записи должны рассчитываться заново.'
+    )
+    with pytest.raises(ValueError):
+        cache.get_info('XXX', [1, 2, 3])
+
+
+def test_history_roundtrip(tmp_path):
+    packages = [
+        ('SWM', [720, 1, 80, 25, 40]),
+        ('RUN', [15000, 1, 75]),
+        ('WLK', [9000, 1, 75, 180]),
+    ]
+    path = str(tmp_path / 'history')
+    with homework.HistoryWriter(path, buffer_size=2) as writer:
+        expected = [writer.append(*package) for package in packages[:2]]
+    with homework.HistoryWriter(path) as writer:
+        expected.append(writer.append(*packages[2]))
+    with homework.HistoryReader(path) as reader:
+        assert len(reader) == 3
+        assert list(reader.messages()) == expected, (
+            'История должна возвращать записанные сообщения.'
+        )
+        assert list(reader.column('action')) == [720, 15000, 9000]
+        height = reader.column('height')
+        assert math.isnan(height[0]) and height[2] == 180
+        assert [reader.types[code] for code in reader.column('type')] == [
+            'SWM', 'RUN', 'WLK'
+        ]
+
+
+def test_Instrumentation_keyword_arguments():
+    instrumentation = homework.Instrumentation()
+    instrumentation.enable()
+    try:
+        training = homework.read_package(
+            workout_type='RUN', data=[15000, 1, 75]
+        )
+    finally:
+        instrumentation.disable()
+    assert isinstance(training, homework.Running), (
+        'Замеры не должны ломать вызовы с именованными аргументами.'
+    )
+    assert instrumentation.snapshot()['read_package']['RUN']['calls'] == 1
+
+
+def test_Instrumentation(tmp_path):
+    instrumentation = homework.Instrumentation()
+    original = homework.read_package
+    instrumentation.enable()
+    try:
+        homework.read_package('RUN', [15000, 1, 75]).show_training_info()
+        with pytest.raises(ValueError):
+            homework.read_package('RUN', [15000, 1])
+        homework.InfoMessage('Swimming', 1, 1, 1, 1).get_message()
+    finally:
+        instrumentation.disable()
+    assert homework.read_package is original, (
+        'После выключения замеров должна остаться исходная функция.'
+    )
+    homework.read_package('RUN', [15000, 1, 75])
+    snapshot = instrumentation.snapshot()
+    assert snapshot['read_package']['RUN']['calls'] == 2
+    assert snapshot['read_package']['RUN']['errors'] == 1
+    assert snapshot['get_spent_calories']['RUN']['calls'] == 1
+    assert snapshot['get_message']['SWM']['calls'] == 1
+    instrumentation.dump_json(str(tmp_path / 'metrics.json'))
+    instrumentation.dump_prometheus(str(tmp_path / 'metrics.prom'))
+    text = (tmp_path / 'metrics.prom').read_text(encoding='utf-8')
+    assert (
+        'homework_stage_errors_total'
+        '{stage="read_package",workout_type="RUN"} 1'
+    ) in text
+    assert (
+        'homework_stage_seconds_bucket'
+        '{stage="read_package",workout_type="RUN",le="+Inf"} 2'
+    ) in text
+
+
+def test_Instrumentation_renderers(tmp_path):
+    instrumentation = homework.Instrumentation()
+    stream = StringIO(
+        '{"workout_type": "RUN", "data": [15000, 1, 75]}\n'
+        '{"workout_type": "SWM", "data": [720, 1, 80, 25, 40]}\n'
+    )
+    instrumentation.enable()
+    try:
+        list(homework.stream_lines(stream))
+        homework.render_many(
+            [homework.read_package('WLK', [9000, 1, 75, 180])
+             .show_training_info()],
+            StringIO()
+        )
+        sink = homework.FileSink(str(tmp_path / 'out.csv'), 'csv')
+        sink.write(homework.read_package('RUN', [15000, 1, 75])
+                   .show_training_info())
+        sink.close()
+    finally:
+        instrumentation.disable()
+    render = instrumentation.snapshot()['render']
+    assert {code: render[code]['calls'] for code in render} == {
+        'RUN': 2, 'SWM': 1, 'WLK': 1
+    }, 'Форматирование вывода должно попадать в замеры.'
+
+
+def test_StageMetrics_percentile():
+    metrics = homework.StageMetrics()
+    for elapsed in [2e-6] * 98 + [2e-3, 0.5]:
+        metrics.observe(elapsed, False)
+    assert metrics.percentile(0.5) == 2.5e-6
+    assert metrics.percentile(0.99) == 1e-2
+    assert metrics.percentile(1.0) == 0.5
+
+
+@pytest.mark.parametrize('mode', ['serial', 'thread', 'process'])
+def test_cli(tmp_path, capsys, mode):
+    (tmp_path / 'a.csv').write_text(
+        'workout_type,action,duration,weight,height\n'
+        'RUN,15000,1,75,\n'
+        'XXX,1,1,1,\n', encoding='utf-8'
+    )
+    (tmp_path / 'b.csv').write_text(
+        'workout_type,action,duration,weight,height\n'
+        'WLK,9000,1,75,180\n', encoding='utf-8'
+    )
+    out = tmp_path / 'out.jsonl'
+    result = homework.cli([
+        str(tmp_path / '*.csv'), '-f', 'csv', '-m', mode, '-w', '2',
+        '--chunk-size', '1', '-t', 'jsonl', '-o', str(out)
+    ])
+    assert result == 0
+    lines = out.read_text(encoding='utf-8').splitlines()
+    assert [json.loads(line)['training_type'] for line in lines] == [
+        'Running', 'SportsWalking'
+    ], 'Командная строка должна обрабатывать все файлы по шаблону.'
+    errors = capsys.readouterr().err.splitlines()
+    assert errors[0] == homework.REJECTED_RECORD.format(
+        number=2, error=homework.UNEXPECTED_TYPE.format(workout_key='XXX')
+    )
+    assert errors[-1].startswith(
+        'Обработано пакетов: 3, отклонено: 1, '
+    ), 'В конце должна выводиться сводка обработки.'
+
+
+def test_cli_csv_output(tmp_path, capsys, monkeypatch):
+    monkeypatch.setattr(homework.sys, 'stdin', StringIO(
+        '{"workout_type": "SWM", "data": [720, 1, 80, 25, 40]}\n'
+    ))
+    assert homework.cli(['-t', 'csv']) == 0
+    assert capsys.readouterr().out.splitlines() == [
+        'training_type,duration,distance,speed,calories',
+        'Swimming,1,0.9935999999999999,1.0,336.0',
+    ]
+
+
+def test_cli_missing_input(tmp_path, capsys):
+    present = tmp_path / 'a.jsonl'
+    present.write_text(
+        '{"workout_type": "RUN", "data": [15000, 1, 75]}\n', encoding='utf-8'
+    )
+    missing = str(tmp_path / 'missing.jsonl')
+    with pytest.raises(SystemExit) as error:
+        homework.cli([str(present), missing])
+    assert error.value.code != 0
+    captured = capsys.readouterr()
+    assert captured.out == '', (
+        'Недоступный файл должен проверяться до обработки остальных.'
+    )
+    assert homework.UNREADABLE_INPUT.format(path=missing) in captured.err
+
+
+def test_validate_packages():
+    packages = [
+        ('RUN', [15000, 1, 75]),
+        ('XXX', [1, 2, 3]),
+        ('WLK', [9000, 1, 75]),
+        ('SWM', [720, 1, 80, '25', 40]),
+        ('RUN', [15000, 1, -75]),
+        ('WLK', [9000, 0, 75, 180]),
+        ('SWM', [720, 1, 80, 25, float('nan')]),
+        ('SWM', [720, 1, 80, 25, 40]),
+        (['x'], [1, 2, 3]),
+        (None, [1, 2, 3]),
+        ('RUN', 5),
+        ('RUN', None),
+        ('RUN', [15000, 1, 10**400]),
+    ]
+    mask, codes = homework.validate_packages(packages)
+    assert list(codes) == [
+        homework.PACKAGE_OK,
+        homework.PACKAGE_UNKNOWN_TYPE,
+        homework.PACKAGE_WRONG_ARITY,
+        homework.PACKAGE_NOT_NUMBER,
+        homework.PACKAGE_OUT_OF_RANGE,
+        homework.PACKAGE_ZERO_DURATION,
+        homework.PACKAGE_OUT_OF_RANGE,
+        homework.PACKAGE_OK,
+        homework.PACKAGE_UNKNOWN_TYPE,
+        homework.PACKAGE_UNKNOWN_TYPE,
+        homework.PACKAGE_WRONG_ARITY,
+        homework.PACKAGE_WRONG_ARITY,
+        homework.PACKAGE_OUT_OF_RANGE,
+    ], 'Каждая строка пачки должна получить свой код ошибки.'
+    assert mask == [code == homework.PACKAGE_OK for code in codes]
+    for valid, package in zip(mask, packages):
+        if valid:
+            homework.read_package(*package).show_training_info()
+
+
+def test_TrainingSession():
+    session = homework.TrainingSession('RUN', 75, start=0)
+    splits = [
+        session.add_sample(minute * 60, 150) for minute in range(1, 101)
+    ]
+    splits = [split for split in splits if split is not None]
+    splits.append(session.finish())
+    assert session.finish() is None
+    assert session.show_training_info() == homework.read_package(
+        'RUN', [15000, 100 * 60 / 3600, 75]
+    ).show_training_info(), (
+        'Итог сессии должен совпадать с итоговым пакетом.'
+    )
+    assert len(splits) == 10, 'Отрезки должны завершаться каждый километр.'
+    assert all(split.distance >= 1 for split in splits[:-1])
+    assert sum(split.duration for split in splits) == pytest.approx(
+        100 / 60
+    )
+    with pytest.raises(ValueError):
+        session.add_sample(0, 10)
+
+
+def test_TrainingSession_swimming():
+    with pytest.raises(ValueError):
+        homework.TrainingSession('SWM', 80)
+    session = homework.TrainingSession('SWM', 80, length_pool=25)
+    for lap in range(1, 41):
+        session.add_sample(lap * 90, 18, laps=1)
+    assert session.show_training_info() == homework.read_package(
+        'SWM', [720, 1, 80, 25, 40]
+    ).show_training_info()
+
+
+def test_TrainingSession_empty():
+    session = homework.TrainingSession('RUN', 75, start=60)
+    message = homework.EMPTY_SESSION.format(workout_key='RUN', start=60)
+    with pytest.raises(ValueError, match=message):
+        session.show_training_info()
+    session.add_sample(60, 150)
+    with pytest.raises(ValueError, match=message):
+        session.training()
+    assert session.finish() is None
+    session.add_sample(120, 150)
+    assert session.show_training_info().duration == 1 / 60
+
+
+def test_ResultStore_threads():
+    store = homework.ResultStore(shards=4)
+    message = homework.read_package('RUN', [15000, 1, 75]).show_training_info()
+    missing = []
+
+    def worker(thread):
+        for number in range(1000):
+            key = (thread, number)
+            store.put(key, message)
+            if store.get(key) is not message:
+                missing.append(key)
+
+    threads = [
+        threading.Thread(target=worker, args=(thread,)) for thread in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not missing, 'Записанные сообщения должны сразу читаться.'
+    assert len(store) == 8000
+    assert store.put_if_absent((0, 0), None) is message
+    assert store.pop((0, 0)) is message and (0, 0) not in store
+
+
+def test_QuantileSketch():
+    values = [(-1) ** number * number / 7 for number in range(1, 2001)]
+    sketch = homework.QuantileSketch(accuracy=0.01)
+    other = homework.QuantileSketch(accuracy=0.01)
+    for number, value in enumerate(values):
+        (sketch if number % 2 else other).add(value)
+    sketch.add(0)
+    sketch.merge(other)
+    exact = sorted(values + [0])
+    for quantile in (0, 0.1, 0.5, 0.9, 0.99, 1):
+        expected = exact[round(quantile * (len(exact) - 1))]
+        assert sketch.quantile(quantile) == pytest.approx(
+            expected, rel=0.01, abs=1e-9
+        ), 'Перцентиль должен оцениваться с заданной точностью.'
+    with pytest.raises(ValueError):
+        sketch.merge(homework.QuantileSketch(accuracy=0.05))
+
+
+def test_Leaderboard():
+    messages = [
+        homework.read_package('SWM', [720, 1, 80, 25, count])
+        .show_training_info()
+        for count in range(1, 51)
+    ]
+    whole = homework.Leaderboard(k=5)
+    first, second = homework.Leaderboard(k=5), homework.Leaderboard(k=5)
+    for user_id, message in enumerate(messages):
+        whole.add(user_id, message, period='week')
+        (first if user_id % 2 else second).add(user_id, message, 'week')
+    first.merge(second)
+    expected = [
+        (user_id, messages[user_id].calories) for user_id in range(49, 44, -1)
+    ]
+    assert whole.top('Swimming', 'calories', 'week') == expected, (
+        'Таблица должна содержать лучшие результаты по убыванию.'
+    )
+    assert first.top('Swimming', 'calories', 'week') == expected, (
+        'Объединённые таблицы должны совпадать с общей.'
+    )
+    assert [
+        user_id for user_id, _ in first.top('Swimming', 'speed', 'week', 2)
+    ] == [49, 48]
+    assert first.percentile('Swimming', 'calories', 0.5, 'week') == (
+        pytest.approx(messages[24].calories, rel=0.01)
+    )
+    assert whole.top('Running', 'calories', 'week') == []
+    with pytest.raises(ValueError):
+        whole.top('Swimming', 'weight', 'week')
+    whole.drop_period('week')
+    assert whole.top('Swimming', 'calories', 'week') == []
+
+
+def test_Leaderboard_one_entry_per_user():
+    def message(count):
+        return homework.read_package(
+            'SWM', [720, 1, 80, 25, count]
+        ).show_training_info()
+
+    board = homework.Leaderboard(k=3)
+    for count in (10, 30, 20):
+        board.add('alice', message(count))
+    board.add('bob', message(5))
+    board.add('carol', message(15))
+    board.add('dave', message(1))
+    assert [user for user, _ in board.top('Swimming', 'calories')] == [
+        'alice', 'carol', 'bob'
+    ], 'Пользователь должен попадать в таблицу один раз, с лучшим итогом.'
+    assert board.top('Swimming', 'calories')[0][1] == message(30).calories
+
+    whole = homework.Leaderboard(k=4)
+    parts = [homework.Leaderboard(k=4) for _ in range(3)]
+    best = {}
+    for number in range(200):
+        user, count = number % 13, (number * 37) % 101 + 1
+        whole.add(user, message(count))
+        parts[number % 3].add(user, message(count))
+        best[user] = max(best.get(user, 0), message(count).calories)
+    for part in parts[1:]:
+        parts[0].merge(part)
+    expected = sorted(best.values(), reverse=True)[:4]
+    for board in (whole, parts[0]):
+        top = board.top('Swimming', 'calories')
+        assert [value for _, value in top] == expected
+        assert len({user for user, _ in top}) == 4
+
+
+def test_Deduplicator():
+    deduplicator = homework.Deduplicator(
+        capacity=1000, exact_size=2, drop_probable=True
+    )
+    packages = [
+        ('device-1', 'RUN', [15000, 1, 75]),
+        ('device-1', 'RUN', [15000, 1, 75]),
+        ('device-2', 'RUN', [15000, 1, 75]),
+        ('device-1', 'WLK', [9000, 1, 75, 180]),
+        ('device-1', 'SWM', [720, 1, 80, 25, 40]),
+        ('device-1', 'RUN', (15000, 1, 75)),
+    ]
+    result = list(deduplicator.filter(packages))
+    assert result == [
+        ('RUN', [15000, 1, 75]),
+        ('RUN', [15000, 1, 75]),
+        ('WLK', [9000, 1, 75, 180]),
+        ('SWM', [720, 1, 80, 25, 40]),
+    ], 'Повторные пакеты одного устройства должны отсеиваться.'
+    stats = deduplicator.stats()
+    assert (stats['seen'], stats['dropped']) == (6, 2)
+    assert (stats['exact_duplicates'], stats['probable_duplicates']) == (
+        1, 1
+    ), 'Старые повторы должны отсеиваться фильтром Блума.'
+
+
+def test_Deduplicator_confirms_bloom_hits():
+    packages = [
+        ('device-1', 'RUN', [15000, 1, 75]),
+        ('device-1', 'WLK', [9000, 1, 75, 180]),
+        ('device-1', 'SWM', [720, 1, 80, 25, 40]),
+        ('device-1', 'RUN', [15000, 1, 75]),
+    ]
+    deduplicator = homework.Deduplicator(capacity=1000, exact_size=2)
+    assert len(list(deduplicator.filter(packages))) == 4, (
+        'Без хранилища неподтверждённый повтор не должен отбрасываться.'
+    )
+    assert deduplicator.stats()['probable_kept'] == 1
+    deduplicator = homework.Deduplicator(
+        capacity=1000, exact_size=2, store=set()
+    )
+    assert len(list(deduplicator.filter(packages))) == 3
+    stats = deduplicator.stats()
+    assert (stats['exact_duplicates'], stats['probable_duplicates']) == (
+        1, 0
+    ), 'Срабатывание фильтра Блума должно подтверждаться хранилищем.'
+    # Ложное срабатывание фильтра: отпечатка нет в хранилище.
+    deduplicator.bloom.bits[:] = b'\xff' * len(deduplicator.bloom.bits)
+    assert not deduplicator.is_duplicate('device-2', 'RUN', [1, 1, 1])
+
+
+def test_BloomFilter_error_rate():
+    bloom = homework.BloomFilter(capacity=10000, error_rate=0.01)
+    for number in range(10000):
+        bloom.add(homework.Deduplicator.fingerprint('add', 'RUN', [number]))
+    false_positives = sum(
+        homework.Deduplicator.fingerprint('check', 'RUN', [number]) in bloom
+        for number in range(10000)
+    )
+    assert false_positives < 200, (
+        'Доля ложных срабатываний должна быть близка к заданной.'
+    )
+
+
+@pytest.mark.parametrize('workout_type, data', [
+    ('RUN', [1206, 12, 6]),
+    ('WLK', [9000, 1, 75, 180]),
+    ('SWM', [1206, 12, 6, 12, 6]),
+])
+def test_show_training_info_single_pass(workout_type, data, monkeypatch):
+    training = homework.read_package(workout_type, data)
+    expected = (
+        training.get_distance(),
+        training.get_mean_speed(),
+        training.get_spent_calories(),
+    )
+    calls = []
+    original = type(training).get_mean_speed
+    monkeypatch.setattr(
+        type(training), 'get_mean_speed',
+        lambda self: calls.append(self) or original(self)
+    )
+    info = training.show_training_info()
+    assert (info.distance, info.speed, info.calories) == expected, (
+        'Метод `show_training_info` должен совпадать с отдельными методами.'
+    )
+    assert len(calls) == 1, (
+        'Метод `show_training_info` должен считать скорость один раз.'
+    )
+
+
+@pytest.mark.parametrize('output', ['text', 'jsonl', 'csv'])
+def test_FileSink(tmp_path, output):
+    packages = [('RUN', [15000, 1, 75]), ('SWM', [720, 1, 80, 25, 40])]
+    messages = [
+        homework.read_package(*package).show_training_info()
+        for package in packages
+    ]
+    path = str(tmp_path / 'results')
+    with homework.FileSink(path, output, max_records=1) as sink:
+        sink.write_many(messages)
+    with homework.FileSink(path, output) as sink:
+        sink.write(messages[0])
+    expected = list(homework.stream_lines(
+        [json.dumps({'workout_type': code, 'data': data})
+         for code, data in packages + packages[:1]],
+        output=output
+    ))
+    header = [homework.OUTPUT_HEADERS.get(output)] * (output == 'csv')
+    with open(path, encoding='utf-8') as file:
+        assert file.read().splitlines() == header + expected, (
+            'Класс `FileSink` должен дописывать строки как `stream_lines`.'
+        )
+
+
+def test_OutputSink_flush():
+    message = homework.read_package('RUN', [15000, 1, 75]).show_training_info()
+    sink = homework.MemorySink(max_records=3, flush_interval=3600)
+    sink.write_many([message] * 2)
+    assert sink.messages == [], (
+        'Приёмник должен копить сообщения до `max_records`.'
+    )
+    sink.write(message)
+    assert sink.messages == [message] * 3 and sink.records == 3
+    sink.flush_interval = 0
+    sink.write(message)
+    assert sink.records == 4, (
+        'Приёмник должен сбрасывать буфер по `flush_interval`.'
+    )
+    sink.write(message)
+    sink.close()
+    assert sink.records == 5, 'Метод `close` должен сбрасывать остаток.'
+    with pytest.raises(ValueError):
+        homework.MemorySink(max_records=0)
+
+
+def test_OutputSink_abstract():
+    class Incomplete(homework.OutputSink):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_RotatingFileSink(tmp_path):
+    message = homework.read_package('RUN', [15000, 1, 75]).show_training_info()
+    line = (homework.render_message(message) + '\n').encode()
+    path = str(tmp_path / 'results.txt')
+    with homework.RotatingFileSink(path, max_bytes=len(line) * 2,
+                                   backup_count=2, max_records=3) as sink:
+        sink.write_many([message] * 7)
+    sizes = [
+        (tmp_path / name).stat().st_size
+        for name in ('results.txt', 'results.txt.1', 'results.txt.2')
+    ]
+    assert sizes == [len(line), len(line) * 2, len(line) * 2], (
+        'Класс `RotatingFileSink` должен ротировать файл по `max_bytes`.'
+    )
+    assert not (tmp_path / 'results.txt.3').exists(), (
+        'Лишние резервные копии должны удаляться.'
+    )
+
+
+def test_SQLiteSink(tmp_path):
+    import sqlite3
+    messages = [
+        homework.read_package(*package).show_training_info()
+        for package in [('RUN', [15000, 1, 75]), ('WLK', [9000, 1, 75, 180])]
+    ]
+    path = str(tmp_path / 'results.db')
+    with homework.SQLiteSink(path, max_records=1) as sink:
+        sink.write_many(messages)
+    connection = sqlite3.connect(path)
+    rows = connection.execute('SELECT * FROM results').fetchall()
+    connection.close()
+    assert rows == [
+        tuple(getattr(message, name) for name in homework.INFO_FIELDS)
+        for message in messages
+    ], 'Класс `SQLiteSink` должен сохранять все поля сообщения.'
+    with pytest.raises(ValueError):
+        homework.SQLiteSink(path, table='results; DROP TABLE results')
+
+
+def test_main_sink():
+    training = homework.read_package('RUN', [15000, 1, 75])
+    sink = homework.MemorySink()
+    with Capturing() as get_message_output:
+        homework.main(training, sink)
+    sink.close()
+    assert get_message_output == [] and sink.messages == [
+        training.show_training_info()
+    ], 'Функция `main` должна писать сообщение в приёмник.'
+
+
+@pytest.mark.parametrize('workout_type, data', [
+    ('RUN', [15000, 1, 75]),
+    ('WLK', [9000, 1, 75, 180]),
+    ('SWM', [720, 1, 80, 25, 40]),
+])
+def test_LazyInfoMessage(workout_type, data, monkeypatch):
+    training = homework.read_package(workout_type, data)
+    expected = training.show_training_info()
+    calls = []
+    for name in ('get_distance', 'get_mean_speed', '_spent_calories'):
+        method = getattr(training, name)
+        monkeypatch.setattr(
+            training, name,
+            lambda *args, name=name, method=method: (
+                calls.append(name) or method(*args)
+            )
+        )
+    message = training.show_lazy_training_info()
+    assert isinstance(message, homework.InfoMessage)
+    assert calls == [], (
+        'Ленивое сообщение не должно ничего считать при создании.'
+    )
+    assert message.calories == expected.calories
+    assert message.calories == expected.calories
+    assert calls.count('_spent_calories') == 1, (
+        'Калории должны считаться один раз.'
+    )
+    assert message == expected and expected == message, (
+        'Ленивое сообщение должно быть равно `InfoMessage`.'
+    )
+    assert message.get_message() == expected.get_message()
+    assert dataclasses.astuple(message) == dataclasses.astuple(expected)
+    assert sorted(set(calls)) == sorted(calls), (
+        'Каждое поле должно считаться не больше одного раза.'
+    )
+
+
+@pytest.mark.parametrize('precision', ['single', 'decimal'])
+@pytest.mark.parametrize('workout_type, rows', [
+    ('RUN', [[9000, 1, 75], [420, 4, 20], [1206, 12, 6]]),
+    ('WLK', [[9000, 1, 75, 180], [420, 4, 20, 42], [1206, 12, 6, 12]]),
+    ('SWM', [[720, 1, 80, 25, 40], [420, 4, 20, 42, 4],
+             [1206, 12, 6, 12, 6]]),
+])
+def test_compute_batch_precision(workout_type, rows, precision):
+    trainings = homework.TrainingColumns(workout_type, precision)
+    trainings.extend(rows)
+    messages = trainings.show_training_info()
+    for row, message in zip(rows, messages):
+        info = homework.read_package(workout_type, row).show_training_info()
+        assert message.get_message() == info.get_message(), (
+            f'Режим `{precision}` не должен менять вывод сообщения.'
+        )
+    error = homework.check_precision(
+        workout_type, trainings.columns, precision
+    )
+    assert error <= homework.PRECISION_TOLERANCE
+
+
+def test_compute_batch_decimal_exact():
+    from decimal import Decimal
+    result = homework.compute_batch(
+        'SWM', {'action': [720], 'duration': [0.3], 'weight': [80],
+                'length_pool': [25], 'count_pool': [40]}, 'decimal'
+    )
+    assert result['distance'] == [Decimal('0.9936')]
+    assert result['speed'][0] == Decimal(1) / Decimal('0.3'), (
+        'Режим `decimal` должен считать по десятичной записи чисел.'
+    )
+
+
+def test_check_precision_loss():
+    columns = {'action': [12345679], 'duration': [1.1], 'weight': [75.3]}
+    with pytest.raises(ValueError):
+        homework.check_precision('RUN', columns, 'single')
+    with pytest.raises(ValueError):
+        homework.compute_batch('RUN', columns, 'half')
+
+
+def test_process_sharded(tmp_path):
+    lines = [
+        json.dumps({'user': user, 'workout_type': code, 'data': data})
+        for user in range(20)
+        for code, data in [('RUN', [15000 + user, 1.1, 75.3]),
+                           ('WLK', [9000, 0.7 + user, 75, 180]),
+                           ('SWM', [720, 1, 80.1, 25, 40 + user])]
+    ] + ['{"workout_type": "XXX", "data": [1]}', 'not json']
+    expected = homework.process_sharded(
+        lines, 1, executor_class=ThreadPoolExecutor
+    ).get_totals()
+    assert expected['Running']['count'] == 20
+    for shards in (2, 3, 7):
+        summary = homework.process_sharded(
+            reversed(lines), shards, str(tmp_path / str(shards)),
+            executor_class=ThreadPoolExecutor
+        )
+        assert summary.rejects == 2
+        assert summary.get_totals() == expected, (
+            'Итоги не должны зависеть от числа частей и порядка пакетов.'
+        )
+    assert len(list((tmp_path / '7').glob('shard-*.json'))) == 7
+    with pytest.raises(ValueError):
+        homework.process_sharded(lines, 0)
+
+
+def test_run_shard_process(tmp_path):
+    path = tmp_path / 'packages.jsonl'
+    path.write_text(
+        '{"user": 1, "workout_type": "RUN", "data": [15000, 1, 75]}\n'
+        '{"user": 2, "workout_type": "RUN", "data": [9000, 1, 75]}\n',
+        encoding='utf-8'
+    )
+    with open(path, encoding='utf-8') as stream:
+        summary = homework.process_sharded(stream, 2)
+    totals = summary.get_totals()['Running']
+    assert totals['count'] == 2
+    assert totals['sum']['distance'] == 9.75 + 5.85
+    assert totals['min']['distance'] == 5.85
+    assert totals['max']['distance'] == 9.75
+
+
+def test_show_training_info_overridden_calories():
+    class Trail(homework.Running):
+        def get_spent_calories(self):
+            return super().get_spent_calories() * 2
+
+    class Hill(homework.Running):
+        def _spent_calories(self, speed):
+            return super()._spent_calories(speed) + 1
+
+    for class_ in (Trail, Hill):
+        training = class_(15000, 1, 75)
+        calories = training.get_spent_calories()
+        assert training.show_training_info().calories == calories, (
+            'Метод `show_training_info` должен учитывать переопределённый '
+            '`get_spent_calories`.'
+        )
+        assert training.show_lazy_training_info().calories == calories
+
+
+def test_LazyInfoMessage_replace():
+    training = homework.read_package('RUN', [15000, 1, 75])
+    message = training.show_lazy_training_info()
+    copy = dataclasses.replace(message, calories=1)
+    assert copy == dataclasses.replace(
+        training.show_training_info(), calories=1
+    ), 'Ленивое сообщение должно копироваться `dataclasses.replace`.'
+    assert message.calories == training.get_spent_calories()
+    assert copy.get_message() != message.get_message()